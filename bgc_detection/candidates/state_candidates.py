@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Convert decoded BGC states of domains into a BGC candidate DataFrame (same columns as threshold_candidates)
+# A protein is part of a candidate if any of its domains is in the BGC state (or if its averaged prediction satisfies a threshold),
+# candidates are runs of consecutive BGC proteins
+# All contigs are processed at once using numpy operations on the domain table
+
+import hashlib
+import numpy as np
+import pandas as pd
+try:
+    from .biosynthetic_pfams import AS_BIO_PFAM_IDS as BIO_PFAM_IDS
+except ImportError:
+    from biosynthetic_pfams import AS_BIO_PFAM_IDS as BIO_PFAM_IDS
+
+CANDIDATE_COLUMNS = ['contig_id', 'candidate_id', 'candidate_hash', 'avg_prediction', 'nucl_length', 'nucl_start', 'nucl_end',
+                     'num_bio_domains', 'num_all_domains', 'num_proteins', 'protein_ids', 'pfam_ids']
+
+
+def get_runs(values, new_group):
+    """
+    Get runs of equal consecutive values, runs do not cross group boundaries
+    :param values: Array of values
+    :param new_group: Boolean array marking first element of each group
+    :return: Tuple of (array of first index of each run, array of last index of each run)
+    """
+    run_starts = np.flatnonzero(new_group | np.append(True, values[1:] != values[:-1]))
+    run_ends = np.append(run_starts[1:], len(values)) - 1
+    return run_starts, run_ends
+
+
+def fill_state_gaps(protein_states, new_contig, gene_starts, gene_ends, max_protein_gap=0, max_nucl_gap=0):
+    """
+    Turn non-BGC proteins between two BGC proteins of the same contig into BGC proteins,
+    if there is given (or smaller) number of them or given (or smaller) number of nucleotides between the BGC proteins
+    :return: Boolean array of BGC proteins
+    """
+    run_starts, run_ends = get_runs(protein_states, new_contig)
+    after_ends = run_ends + 1
+    # Gap runs with a BGC protein of the same contig on both sides (neighbouring runs always have a different state)
+    inner = ~protein_states[run_starts] & ~new_contig[run_starts] & (after_ends < len(protein_states))
+    inner[inner] &= ~new_contig[after_ends[inner]]
+    merge = np.zeros(len(run_starts), dtype=bool)
+    merge[inner] = (run_ends[inner] - run_starts[inner] + 1 <= max_protein_gap) \
+        | (gene_starts[after_ends[inner]] - gene_ends[run_starts[inner] - 1] <= max_nucl_gap)
+    return protein_states | np.repeat(merge, run_ends - run_starts + 1)
+
+
+def get_state_candidates(domains, states, predictions, max_protein_gap=0, max_nucl_gap=0, min_bio_domains=0,
+                         min_proteins=0, min_nucleotides=0, threshold=None):
+    """
+    Get a BGC candidate DataFrame from decoded BGC states of domains in multiple contigs.
+    BGC proteins are decided by one of two rules:
+    - states (e.g. Viterbi states): a protein is a BGC protein if any of its domains is in the BGC state
+    - threshold: a protein is a BGC protein if its averaged domain prediction is at least the threshold, states are ignored
+    (same as candidates/threshold_candidates.py)
+    :param domains: Domain DataFrame with contig_id, protein_id, gene_start, gene_end and pfam_id column, domains of each contig consecutive and in order
+    :param states: Array of BGC state of each domain (0 = non-BGC, 1 = BGC), not used when threshold is provided
+    :param predictions: Array of BGC prediction score of each domain, averaged by protein and candidate to get the avg_prediction column
+    :param max_protein_gap: Merge candidates with given (or smaller) number of non-BGC proteins between them
+    :param max_nucl_gap: Merge candidates with given (or smaller) number of nucleotides between them
+    :param min_bio_domains: Discard candidates with less than min_bio_domains biosynthetic domains
+    :param min_proteins: Discard candidates with less than min_proteins proteins
+    :param min_nucleotides: Discard candidates with less than min_nucleotides nucleotides
+    :param threshold: Averaged protein prediction threshold (inclusive), use the states of the domains if not provided
+    :return: DataFrame of BGC candidates
+    """
+    if not len(domains):
+        return pd.DataFrame(columns=CANDIDATE_COLUMNS)
+    states = np.asarray(states)
+    predictions = np.asarray(predictions, dtype=np.float64)
+    contig_ids = domains['contig_id'].values
+    protein_ids = domains['protein_id'].values
+    pfam_ids = domains['pfam_id'].values
+    num_domains = len(domains)
+
+    new_contig = np.append(True, contig_ids[1:] != contig_ids[:-1])
+    protein_starts = np.flatnonzero(new_contig | np.append(True, protein_ids[1:] != protein_ids[:-1]))
+    protein_sizes = np.diff(np.append(protein_starts, num_domains))
+    protein_predictions = np.add.reduceat(predictions, protein_starts) / protein_sizes
+    if threshold is not None:
+        protein_states = protein_predictions >= threshold
+    else:
+        protein_states = np.maximum.reduceat(states, protein_starts) > 0
+    protein_new_contig = new_contig[protein_starts]
+    gene_starts = domains['gene_start'].values[protein_starts].astype(np.int64)
+    gene_ends = domains['gene_end'].values[protein_starts].astype(np.int64)
+
+    protein_states = fill_state_gaps(protein_states, protein_new_contig, gene_starts, gene_ends,
+                                     max_protein_gap=max_protein_gap, max_nucl_gap=max_nucl_gap)
+    run_starts, run_ends = get_runs(protein_states, protein_new_contig)
+    is_bgc = protein_states[run_starts]
+    first_proteins, last_proteins = run_starts[is_bgc], run_ends[is_bgc]
+
+    prediction_sums = np.concatenate([[0], np.cumsum(protein_predictions)])
+    domain_ends = protein_starts + protein_sizes
+    candidates = pd.DataFrame({
+        'contig_id': contig_ids[protein_starts[first_proteins]],
+        'avg_prediction': (prediction_sums[last_proteins + 1] - prediction_sums[first_proteins]) / (last_proteins - first_proteins + 1),
+        'nucl_start': gene_starts[first_proteins],
+        'nucl_end': gene_ends[last_proteins],
+        'num_proteins': last_proteins - first_proteins + 1,
+        'num_all_domains': domain_ends[last_proteins] - protein_starts[first_proteins],
+        'protein_ids': [';'.join(protein_ids[protein_starts[first:last + 1]]) for first, last in zip(first_proteins, last_proteins)],
+        'pfam_ids': [';'.join(pfam_ids[protein_starts[first]:domain_ends[last]]) for first, last in zip(first_proteins, last_proteins)]
+    })
+    candidates['num_bio_domains'] = [len(BIO_PFAM_IDS.intersection(ids.split(';'))) for ids in candidates['pfam_ids']]
+    candidates['nucl_length'] = candidates['nucl_end'] - candidates['nucl_start'] + 1
+    candidates['candidate_hash'] = [hashlib.md5(ids.encode('utf-8')).hexdigest() for ids in candidates['pfam_ids']]
+    candidates['candidate_id'] = ['{}({}-{})'.format(contig_id, start, end) for contig_id, start, end
+                                  in zip(candidates['contig_id'], candidates['nucl_start'], candidates['nucl_end'])]
+
+    keep = (candidates['num_bio_domains'] >= min_bio_domains) & (candidates['num_proteins'] >= min_proteins) \
+        & (candidates['nucl_length'] >= min_nucleotides)
+    return candidates[keep][CANDIDATE_COLUMNS].reset_index(drop=True)
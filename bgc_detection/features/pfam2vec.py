@@ -2,10 +2,57 @@
 # David Prihoda
 # Create pfam2vec embedding from corpus of pfam IDs
 # Corpus words should be separated by spaces, documents (genomes) should be separated by newlines
+# Embeddings of the parameter grid are trained concurrently, the CPU cores of the node are split between the jobs
 
 import word2vec
 import os
 import argparse
+import itertools
+import json
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+METHOD_CODES = {
+    'skipgram': 0,
+    'cbow': 1
+}
+
+
+def get_summary_path(out_path):
+    return os.path.splitext(out_path)[0] + '.summary.json'
+
+
+def train_pfam2vec(corpus_path, out_path, num_features, method, iters, window, threads):
+    """
+    Train one pfam2vec embedding and save a JSON summary with its parameters, training time and vocabulary size next to it.
+    The embedding is first saved to a temporary file, so that an interrupted job is not taken as finished.
+    """
+    partial_path = os.path.splitext(out_path)[0] + '.partial.bin'
+    print('Building Word2Vec:{} model for {}, producing {} dimensions using {} threads'.format(
+        method, os.path.basename(corpus_path), num_features, threads))
+    start = time.time()
+    word2vec.word2vec(corpus_path, partial_path, size=num_features, cbow=METHOD_CODES[method], iter_=iters, window=window,
+                      threads=threads, verbose=False)
+    seconds = time.time() - start
+    os.rename(partial_path, out_path)
+
+    model = word2vec.load(out_path, kind='bin')
+    summary = {
+        'corpus': corpus_path,
+        'method': method,
+        'dimensions': num_features,
+        'window': window,
+        'iter': iters,
+        'threads': threads,
+        'seconds': seconds,
+        'vocabulary_size': len(model.vocab)
+    }
+    with open(get_summary_path(out_path), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print('Saved to {} ({:.0f} seconds, {} words)'.format(out_path, seconds, len(model.vocab)))
+    return summary
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -22,26 +69,37 @@ if __name__ == "__main__":
                       help="Method (cbow, skipgram). Repeat for more methods.", metavar="FILE")
     parser.add_argument("-o", "--output", dest="output", required=True,
                       help="Output folder.", metavar="FILE")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                      help="Number of embeddings trained at the same time.", metavar="INT")
+    parser.add_argument("-t", "--threads", dest="threads", type=int,
+                      help="Number of threads of each job (default: number of CPUs divided by number of jobs).", metavar="INT")
+    parser.add_argument("--force", dest="force", action='store_true',
+                      help="Train also embeddings that already exist in the output folder.")
     options = parser.parse_args()
 
-    METHOD_CODES = {
-        'skipgram': 0,
-        'cbow': 1
-    }
-
     if not options.iter:
         options.iter = [5]
 
     if not options.method:
         options.method = ['skipgram', 'cbow']
 
-    for corpus_path in options.input:
-        for num_features in options.dimensions:
-            for iters in options.iter:
-                for method in options.method:
-                    corpus_name = os.path.splitext(os.path.basename(corpus_path))[0]
-                    out_path = os.path.join(options.output, 'pfam2vec_{}_{}_{}dim_{}win_{}iter.bin'.format(corpus_name, method, num_features, options.window, iters))
-                    print('-'*80)
-                    print('Building Word2Vec:{} model for {}, producing {} dimensions'.format(method, corpus_name, num_features))
-                    word2vec.word2vec(corpus_path, out_path, size=num_features, cbow=METHOD_CODES[method], iter_=iters, window=options.window, verbose=True)
-                    print('\nSaved to ', out_path)
+    threads = options.threads or max(multiprocessing.cpu_count() // options.jobs, 1)
+
+    tasks = []
+    for corpus_path, num_features, iters, method in itertools.product(options.input, options.dimensions, options.iter, options.method):
+        corpus_name = os.path.splitext(os.path.basename(corpus_path))[0]
+        out_path = os.path.join(options.output, 'pfam2vec_{}_{}_{}dim_{}win_{}iter.bin'.format(corpus_name, method, num_features, options.window, iters))
+        if os.path.exists(out_path) and not options.force:
+            print('Skipping existing embedding:', out_path)
+            continue
+        tasks.append((corpus_path, out_path, num_features, method, iters, options.window, threads))
+
+    print('-'*80)
+    print('Training {} embeddings, {} at a time with {} threads each'.format(len(tasks), options.jobs, threads))
+    print('-'*80)
+
+    # Training runs in word2vec subprocesses, so threads are enough to run the jobs concurrently
+    with ThreadPool(options.jobs) as pool:
+        pool.starmap(train_pfam2vec, tasks)
+
+    print('Done.')
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Update an existing pfam2vec embedding with vectors of new pfam IDs without retraining on the whole corpus
+# New vectors are trained using skip-gram with negative sampling on a corpus of new documents,
+# existing vectors are kept frozen (or fine-tuned with a smaller learning rate) and context vectors are trained from scratch
+# Corpus words should be separated by spaces, documents (genomes) should be separated by newlines
+# Run from the bgc_detection folder as: python -m features.pfam2vec_update
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+try:
+    from utils.embedding import read_pfam2vec, compile_pfam2vec, is_compiled_pfam2vec
+except ImportError:
+    from bgc_detection.utils.embedding import read_pfam2vec, compile_pfam2vec, is_compiled_pfam2vec
+
+
+def read_corpus(corpus_paths):
+    """
+    Read corpus documents
+    :param corpus_paths: List of corpus txt file paths
+    :return: List of documents, each document is a list of words
+    """
+    documents = []
+    for corpus_path in corpus_paths:
+        with open(corpus_path) as f:
+            documents += [line.split() for line in f if line.strip()]
+    return documents
+
+
+def get_skipgram_pairs(codes, doc_ids, window, positions=None):
+    """
+    Get (center word, context word) pairs within given window for given center word positions
+    :param codes: Array of word codes of all documents concatenated
+    :param doc_ids: Array with document number of each word
+    :param window: Maximum distance of center and context word
+    :param positions: Array of center word positions, all words if not provided
+    :return: Tuple of (array of center word codes, array of context word codes)
+    """
+    if window < 1:
+        raise ValueError('Window has to be at least 1, got {}'.format(window))
+    if positions is None:
+        positions = np.arange(len(codes))
+    centers = []
+    contexts = []
+    for offset in range(1, window + 1):
+        for context_positions in [positions - offset, positions + offset]:
+            valid = (context_positions >= 0) & (context_positions < len(codes))
+            valid[valid] = doc_ids[context_positions[valid]] == doc_ids[positions[valid]]
+            centers.append(codes[positions[valid]])
+            contexts.append(codes[context_positions[valid]])
+    return np.concatenate(centers), np.concatenate(contexts)
+
+
+def count_skipgram_pairs(doc_ids, window):
+    """
+    Count (center word, context word) pairs within given window without creating them
+    :param doc_ids: Array with document number of each word
+    :param window: Maximum distance of center and context word
+    :return: Number of pairs
+    """
+    return sum(2 * int((doc_ids[offset:] == doc_ids[:-offset]).sum()) for offset in range(1, window + 1))
+
+
+def sgns_step(W, C, centers, contexts, negatives, word_alpha, context_alpha):
+    """
+    Perform one SGD step of skip-gram with negative sampling on a batch of word pairs
+    :param W: Matrix of word vectors, updated in place
+    :param C: Matrix of context vectors, updated in place
+    :param centers: Array of center word codes
+    :param contexts: Array of context word codes
+    :param negatives: Matrix of negative samples (one row for each pair)
+    :param word_alpha: Learning rate of the word vector of each word (0 for frozen words)
+    :param context_alpha: Learning rate of the context vectors
+    """
+    targets = np.concatenate([contexts[:, None], negatives], axis=1)
+    labels = np.zeros(targets.shape, dtype=np.float32)
+    labels[:, 0] = 1
+    v = W[centers]
+    u = C[targets]
+    scores = 1 / (1 + np.exp(-np.einsum('bd,bkd->bk', v, u)))
+    g = labels - scores
+    grad_v = np.einsum('bk,bkd->bd', g, u)
+    grad_u = g[:, :, None] * v[:, None, :]
+    np.add.at(C, targets.ravel(), (grad_u * context_alpha).reshape(-1, W.shape[1]))
+    np.add.at(W, centers, grad_v * word_alpha[centers][:, None])
+
+
+def update_pfam2vec(vectors, documents, window=5, negative=5, iters=5, alpha=0.025, min_count=5, fine_tune_alpha=0.0,
+                    batch_size=1024, seed=0, verbose=1):
+    """
+    Add vectors of new words to an existing embedding by training on given documents.
+    The context vectors of the original word2vec model are not stored in the embedding, so they are trained again
+    on the new documents (starting from zero as in word2vec) against the frozen existing word vectors,
+    while the word vectors of the new words are trained against them.
+    :param vectors: DataFrame of existing vectors indexed by word
+    :param documents: List of documents, each document is a list of words
+    :param window: Maximum distance of center and context word
+    :param negative: Number of negative samples for each word pair
+    :param iters: Number of iterations over the documents
+    :param alpha: Starting learning rate of new words, decreased linearly to zero
+    :param min_count: Minimum number of occurences of a new word in the documents
+    :param fine_tune_alpha: Starting learning rate of existing words, 0 to keep them frozen
+    :param batch_size: Number of word pairs in each SGD step (approximately, pairs of batch_size / (2 * window) center words are used)
+    :param seed: Random seed
+    :param verbose: Verbosity
+    :return: DataFrame of existing and new vectors indexed by word, new words are added to the end
+    """
+    if window < 1:
+        raise ValueError('Window has to be at least 1, got {}'.format(window))
+    random = np.random.RandomState(seed)
+    existing = pd.Index(vectors.index.astype(str))
+    num_existing, dimensions = vectors.shape
+    tokens = np.concatenate([np.asarray(doc, dtype=object) for doc in documents]) if documents else np.array([], dtype=object)
+    doc_ids = np.repeat(np.arange(len(documents)), [len(doc) for doc in documents])
+    counts = pd.Series(tokens).value_counts()
+    is_new = (existing.get_indexer(counts.index) == -1) & (counts.values >= min_count)
+    new_words = counts.index[is_new]
+    words = existing.append(pd.Index(new_words))
+    if verbose:
+        print('Training {} new words ({} existing words {})'.format(
+            len(new_words), num_existing, 'fine-tuned' if fine_tune_alpha else 'frozen'))
+
+    existing_vectors = vectors.values.astype(np.float32)
+    W = np.concatenate([existing_vectors, ((random.rand(len(new_words), dimensions) - 0.5) / dimensions).astype(np.float32)])
+    C = np.zeros((len(words), dimensions), dtype=np.float32)
+    word_alpha = np.concatenate([np.full(num_existing, fine_tune_alpha), np.full(len(new_words), alpha)]).astype(np.float32)
+
+    # Words not in the vocabulary are discarded
+    codes = words.get_indexer(tokens)
+    known = codes != -1
+    codes, doc_ids = codes[known], doc_ids[known]
+    if verbose:
+        print('Training on {} word pairs from {} documents'.format(count_skipgram_pairs(doc_ids, window), len(documents)))
+
+    # Negative samples are drawn from the unigram distribution raised to 3/4
+    noise = (counts.reindex(words).fillna(0).values + 1) ** 0.75
+    noise_cdf = np.cumsum(noise / noise.sum())
+
+    # Pairs are created in each step for a random batch of center words, so that all pairs are never stored at once
+    centers_per_step = max(1, batch_size // (2 * window))
+    num_steps = iters * int(np.ceil(len(codes) / centers_per_step))
+    step = 0
+    for iteration in range(iters):
+        order = random.permutation(len(codes))
+        for start in range(0, len(order), centers_per_step):
+            centers, contexts = get_skipgram_pairs(codes, doc_ids, window, positions=order[start:start + centers_per_step])
+            negatives = np.minimum(np.searchsorted(noise_cdf, random.rand(len(centers), negative)), len(words) - 1)
+            decay = max(1 - step / num_steps, 0.0001)
+            sgns_step(W, C, centers, contexts, negatives, word_alpha * decay, alpha * decay)
+            step += 1
+        if verbose:
+            print('Iteration {}/{} done'.format(iteration + 1, iters))
+
+    return pd.DataFrame(W, index=pd.Index(words, name='pfam_id'))
+
+
+def save_word2vec_bin(vectors, path):
+    """
+    Save vectors in the word2vec binary format
+    :param vectors: DataFrame of vectors indexed by word
+    :param path: Output .bin file path
+    """
+    matrix = vectors.values.astype(np.float32)
+    with open(path, 'wb') as f:
+        f.write('{} {}\n'.format(matrix.shape[0], matrix.shape[1]).encode('utf-8'))
+        for word, vector in zip(vectors.index, matrix):
+            f.write(str(word).encode('utf-8') + b' ' + vector.tobytes() + b'\n')
+
+
+def save_pfam2vec(vectors, path):
+    """
+    Save vectors as a compiled .npy file, CSV file or word2vec .bin file based on the extension of given path
+    """
+    if is_compiled_pfam2vec(path):
+        compile_pfam2vec(vectors, path, version=os.path.basename(path))
+    elif path.endswith('.csv'):
+        vectors.to_csv(path)
+    else:
+        save_word2vec_bin(vectors, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--vectors", dest="vectors", required=True,
+                        help="Existing pfam2vec embedding (word2vec .bin, .csv or compiled .npy file).", metavar="FILE")
+    parser.add_argument("-i", "--input", dest="input", required=True, action='append',
+                        help="Corpus txt file with new documents (repeat for multiple files).", metavar="FILE")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output embedding path (.bin, .csv or compiled .npy file).", metavar="FILE")
+    parser.add_argument("-w", "--window", dest="window", type=int, default=5,
+                        help="Window size.", metavar="INT")
+    parser.add_argument("-n", "--negative", dest="negative", type=int, default=5,
+                        help="Number of negative samples.", metavar="INT")
+    parser.add_argument("-it", "--iter", dest="iter", type=int, default=5,
+                        help="Number of iterations.", metavar="INT")
+    parser.add_argument("--alpha", dest="alpha", type=float, default=0.025,
+                        help="Starting learning rate of new words.", metavar="FLOAT")
+    parser.add_argument("--min-count", dest="min_count", type=int, default=5,
+                        help="Minimum number of occurences of a new word.", metavar="INT")
+    parser.add_argument("--fine-tune", dest="fine_tune", type=float, default=0,
+                        help="Fine-tune existing vectors with given starting learning rate (default: keep them frozen).", metavar="FLOAT")
+    options = parser.parse_args()
+    if options.window < 1:
+        parser.error('Window has to be at least 1')
+
+    vectors = read_pfam2vec(options.vectors)
+    documents = read_corpus(options.input)
+    updated = update_pfam2vec(vectors, documents, window=options.window, negative=options.negative, iters=options.iter,
+                              alpha=options.alpha, min_count=options.min_count, fine_tune_alpha=options.fine_tune)
+    save_pfam2vec(updated, options.output)
+    print('Saved {} vectors ({} new) to {}'.format(len(updated), len(updated) - len(vectors), options.output))
@@ -1,13 +1,43 @@
 #!/usr/bin/env python
 # David Prihoda
 # Generate pfam corpus for training pfam2vec from Domain CSV files
-# Will produce a single line for each input file, with pfam IDs separated by spaces
+# Will produce a single line for each input file (or each contig), with pfam IDs separated by spaces
+# Files are read in parallel, documents are written in the order of sorted input file paths
 
 import argparse
 
 import os
 import pandas as pd
 import glob
+from multiprocessing import Pool
+from functools import partial
+
+
+def get_documents(path, maxevalue, by_contig=False):
+    """
+    Read pfam IDs of a Domain CSV file as corpus documents
+    :param path: Path to Domain CSV file
+    :param maxevalue: Maximum domain independent e-value
+    :param by_contig: Produce one document for each contig instead of one for the whole file
+    :return: List of documents, pfam IDs separated by spaces
+    """
+    columns = ['pfam_id', 'evalue', 'contig_id'] if by_contig else ['pfam_id', 'evalue']
+    domains = pd.read_csv(path, usecols=columns, dtype={'pfam_id': str, 'contig_id': str})
+    domains = domains[domains['evalue'] <= maxevalue]
+    if by_contig:
+        return [' '.join(pfam_ids) for _, pfam_ids in domains.groupby('contig_id', sort=False)['pfam_id']]
+    return [' '.join(domains['pfam_id'].values)]
+
+
+def get_shard_paths(output, num_shards):
+    """
+    Get output paths of corpus shards, e.g. corpus.txt will be sharded into corpus.0.txt, corpus.1.txt, ...
+    """
+    if num_shards == 1:
+        return [output]
+    base, ext = os.path.splitext(output)
+    return ['{}.{}{}'.format(base, i, ext) for i in range(num_shards)]
+
 
 if __name__ == "__main__":
     # Parse command line
@@ -19,18 +49,31 @@ if __name__ == "__main__":
                         help="Output corpus txt file.", metavar="FILE")
     parser.add_argument("-e", "--maxevalue", dest="maxevalue", required=True, type=float,
                         help="Maximum domain independent e-value.", metavar="FLOAT")
+    parser.add_argument("-j", "--jobs", dest="jobs", required=False, type=int,
+                        help="Number of processes used to read the files (default: number of CPUs).", metavar="INT")
+    parser.add_argument("--by-contig", dest="by_contig", action='store_true',
+                        help="Produce one document for each contig instead of one for each file.")
+    parser.add_argument("--shards", dest="shards", required=False, type=int, default=1,
+                        help="Split the documents into given number of corpus files (assigned in turn).", metavar="INT")
     options = parser.parse_args()
 
-    count = 0
-    paths = list(glob.glob(os.path.join(options.input, '*.csv')))
-    for path in paths:
-        count += 1
-        with open(options.output, 'a') as corpusfile:
-            print("{} ({}/{})".format(path, count, len(paths)))
-            domains = pd.read_csv(path)
-            domains = domains[domains['evalue'] <= options.maxevalue]
-            corpusfile.write(' '.join(domains['pfam_id'].values))
-            corpusfile.write('\n')
+    paths = sorted(glob.glob(os.path.join(options.input, '*.csv')))
+    shard_paths = get_shard_paths(options.output, options.shards)
+    shard_files = [open(path, 'w') for path in shard_paths]
+
+    num_documents = 0
+    task = partial(get_documents, maxevalue=options.maxevalue, by_contig=options.by_contig)
+    with Pool(options.jobs) as pool:
+        # Documents are received in the order of input paths, while the following files are read in the background
+        for count, documents in enumerate(pool.imap(task, paths, chunksize=4)):
+            print("{} ({}/{})".format(paths[count], count + 1, len(paths)))
+            for document in documents:
+                corpusfile = shard_files[num_documents % len(shard_files)]
+                corpusfile.write(document)
+                corpusfile.write('\n')
+                num_documents += 1
 
-    print('Saved corpus of {} domain files to {}'.format(count, options.output))
+    for corpusfile in shard_files:
+        corpusfile.close()
 
+    print('Saved corpus of {} documents from {} domain files to {}'.format(num_documents, len(paths), ', '.join(shard_paths)))
@@ -1,3 +1,3 @@
 from .hmm_discrete import DiscreteHMM, GeneBorderHMM, ClusterFinderHMM
 from .hmm_gaussian import GaussianHMM
-from .rnn import KerasRNN
\ No newline at end of file
+from .rnn import KerasRNN, KerasEmbeddingRNN
\ No newline at end of file
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# Convert the pickled ClusterFinder model (Python 2 pickles of starting, transition and emission probability and vocabulary)
+# into a compact NPZ file, which can be used as param_dir of ClusterFinderHMM or loaded directly using ClusterFinderHMM.load_npz
+# Run from the bgc_detection folder as: python -m models.convert_clusterfinder
+
+import argparse
+from .hmm_discrete import ClusterFinderHMM
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", dest="input", required=True,
+                        help="Directory with the ClusterFinder model pickles.", metavar="DIR")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output .npz file path.", metavar="FILE")
+    options = parser.parse_args()
+
+    model = ClusterFinderHMM().fit(None, None, param_dir=options.input)
+    model.save_npz(options.output, meta={'source': 'ClusterFinder'})
+    print('Saved ClusterFinder model with {} pfam IDs to {}'.format(len(model.vocabulary_), options.output))
@@ -5,16 +5,179 @@
 # Starting and transition probability have to be provided.
 
 import numpy as np
-from hmmlearn import hmm
 import pandas as pd
 from sklearn.base import BaseEstimator, ClassifierMixin
 import pickle
 import os
+from .hmm_kernels import DiscreteHMMParams, get_frame_probs, get_segment_probs, count_emissions, forward_backward, viterbi, FixedLagSmoother, split_frames
+import json
+import sys
+try:
+    from utils.vocabulary import get_vocabulary, PfamLookup
+    from utils.npz import save_npz, load_npz
+except ImportError:
+    from bgc_detection.utils.vocabulary import get_vocabulary, PfamLookup
+    from bgc_detection.utils.npz import save_npz, load_npz
+
+HMM_NPZ_FORMAT_VERSION = 1
 
 class HMM(BaseEstimator, ClassifierMixin):
     """
     HMM model parent class providing Sklearn mixins and saving/loading functionality
     """
+    def __init__(self, vocabulary=None):
+        """
+        :param vocabulary: Canonical PfamVocabulary or path to vocabulary JSON, used to look up words by the integer pfam_code column.
+        """
+        self.vocabulary = vocabulary
+
+    def _get_lookup(self):
+        """
+        Get cached PfamLookup of pfam IDs in our vocabulary and array of their word indexes
+        :return: Tuple of (PfamLookup, numpy array of word indexes)
+        """
+        cached = getattr(self, '_lookup', None)
+        if cached is None:
+            pfam_ids, word_indexes = self._get_vocabulary_words()
+            cached = (PfamLookup(pfam_ids, get_vocabulary(getattr(self, 'vocabulary', None))), np.asarray(word_indexes, dtype=np.int64))
+            self._lookup = cached
+        return cached
+
+    def _get_word_indexes(self, X):
+        """
+        Turn pfam IDs of a Domain DataFrame into word indexes
+        :param X: DataFrame of domains with pfam_id column
+        :return: Tuple of (numpy array of word indexes, boolean numpy array marking pfam IDs present in our vocabulary)
+        """
+        lookup, word_indexes = self._get_lookup()
+        rows = lookup.get_rows(X)
+        known = rows >= 0
+        return np.where(known, word_indexes[rows], -1), known
+
+    def _get_posteriors(self, X_list):
+        """
+        Get posterior probability of each state for each domain in a list of samples.
+        All samples are processed in one vectorized forward-backward call, resetting the state at sample boundaries.
+        :param X_list: List of Domain DataFrames
+        :return: List of posterior matrices (one row for each domain, one column for each state)
+        """
+        if not X_list:
+            return []
+        lengths = [len(X) for X in X_list]
+        word_vector = np.concatenate([self.get_sample_vector(X) for X in X_list])
+        frame_probs = get_frame_probs(self.model_.emissionprob_, word_vector)
+        posteriors, logprob = forward_backward(self.model_.startprob_, self.model_.transmat_, frame_probs, lengths)
+        return split_frames(posteriors, lengths)
+
+    def get_emission_frames(self, X_list):
+        """
+        Get emission probabilities of the frames between which the two state (OUT, BGC) model transitions,
+        so that the forward-backward pass can be repeated with different starting and transition probability.
+        :param X_list: List of Domain DataFrames
+        :return: Tuple of (frame probability matrix with OUT and BGC column, number of frames of each sample, frame index of each domain)
+        """
+        lengths = [len(X) for X in X_list]
+        word_vector = np.concatenate([self.get_sample_vector(X) for X in X_list])
+        frame_probs = get_frame_probs(self.model_.emissionprob_, word_vector)
+        return frame_probs, lengths, np.arange(len(word_vector))
+
+    def get_transition_params(self, startprob, transmat):
+        """
+        Get starting and transition probability of the frames returned by get_emission_frames
+        :param startprob: Starting probability [negative_starting_prob, positive_starting_prob], as passed to fit
+        :param transmat: Two state transition matrix, as passed to fit
+        :return: Tuple of (starting probability, transition matrix)
+        """
+        return np.asarray(startprob, dtype=np.float64), np.asarray(transmat, dtype=np.float64)
+
+    def get_two_state_params(self):
+        """
+        Get starting and transition probability of the trained model in the two state form passed to fit (inverse of get_transition_params)
+        :return: Tuple of (starting probability [negative_starting_prob, positive_starting_prob], two state transition matrix)
+        """
+        return np.asarray(self.model_.startprob_, dtype=np.float64), np.asarray(self.model_.transmat_, dtype=np.float64)
+
+    def predict_list(self, X_list):
+        """
+        Get BGC prediction score for a list of Domain DataFrames, predicted in one vectorized call
+        :param X_list: List of DataFrames with pfam domains
+        :return: List of numpy arrays of BGC prediction scores for each domain
+        """
+        return [self._get_prediction(posteriors) for posteriors in self._get_posteriors(X_list)]
+
+    def decode_list(self, X_list, method='viterbi', threshold=0.5):
+        """
+        Get BGC state of each domain for a list of Domain DataFrames, decoded in one vectorized call
+        :param X_list: List of DataFrames with pfam domains
+        :param method: 'viterbi' for the most likely sequence of states, 'posterior' for BGC prediction score satisfying given threshold
+        :param threshold: BGC prediction score threshold (inclusive) used with the 'posterior' method
+        :return: Tuple of (list of numpy arrays of BGC states (0 = non-BGC, 1 = BGC), list of numpy arrays of BGC prediction scores)
+        """
+        if method not in ('viterbi', 'posterior'):
+            raise ValueError('Invalid decoding method "{}", expected viterbi or posterior'.format(method))
+        if not X_list:
+            return [], []
+        frame_probs, frame_lengths, frame_index = self.get_emission_frames(X_list)
+        startprob, transmat = self._get_frame_params()
+        posteriors, _ = forward_backward(startprob, transmat, frame_probs, frame_lengths)
+        if method == 'viterbi':
+            frame_states = viterbi(startprob, transmat, frame_probs, frame_lengths)
+        else:
+            frame_states = (posteriors[:, 1] >= threshold).astype(np.int64)
+        lengths = [len(X) for X in X_list]
+        return split_frames(frame_states[frame_index], lengths), split_frames(posteriors[frame_index, 1], lengths)
+
+    def predict_stream(self, chunks, lag=50):
+        """
+        Get BGC prediction scores of a stream of domains using fixed-lag smoothing.
+        Score of each domain is calculated from all previous domains and `lag` following frames (domains, or proteins in GeneBorderHMM),
+        so it is returned as soon as those arrive and only the last `lag` frames are kept in memory.
+        :param chunks: Iterable of consecutive Domain DataFrames of one sequence (e.g. domains of a contig as they are annotated)
+        :param lag: Number of following frames used for the score of each domain
+        :return: Generator of numpy arrays of BGC prediction scores, together they contain one score for each domain of the stream, in order
+        """
+        startprob, transmat = self._get_frame_params()
+        smoother = FixedLagSmoother(startprob, transmat, lag)
+        pending_sizes = np.zeros(0, dtype=np.int64)
+        for frame_probs, frame_sizes in self._get_stream_frames(chunks):
+            pending_sizes = np.concatenate([pending_sizes, frame_sizes])
+            posteriors = smoother.push(frame_probs)
+            if len(posteriors):
+                yield np.repeat(posteriors[:, 1], pending_sizes[:len(posteriors)])
+                pending_sizes = pending_sizes[len(posteriors):]
+        posteriors = smoother.flush()
+        if len(posteriors):
+            yield np.repeat(posteriors[:, 1], pending_sizes)
+
+    def _get_frame_params(self):
+        """
+        Get starting and transition probability of the frames of the two state (OUT, BGC) model
+        """
+        return self.model_.startprob_, self.model_.transmat_
+
+    def _get_stream_frames(self, chunks):
+        """
+        Turn stream of Domain DataFrames into a stream of frame emission probabilities
+        :return: Generator of tuples (frame probability matrix with OUT and BGC column, number of domains of each frame)
+        """
+        for X in chunks:
+            if len(X):
+                yield get_frame_probs(self.model_.emissionprob_, self.get_sample_vector(X)), np.ones(len(X), dtype=np.int64)
+
+    def predict(self, X):
+        """
+        Get BGC prediction score for a Domain DataFrame
+        :param X: DataFrame with pfam domains
+        :return: numpy array of BGC prediction scores for each domain in X
+        """
+        return self.predict_list([X])[0]
+
+    def __getstate__(self):
+        # The lookup is created again when needed
+        state = self.__dict__.copy()
+        state.pop('_lookup', None)
+        return state
+
     def save(self, path):
         with open(path, 'wb') as f:
             pickle.dump(self, f)
@@ -25,6 +188,101 @@ class HMM(BaseEstimator, ClassifierMixin):
         with open(path, 'rb') as f:
             return pickle.load(f)
 
+    def save_npz(self, path, meta=None):
+        """
+        Save trained model as a compact NPZ file with starting, transition and emission probability arrays
+        and the vocabulary (pfam IDs and their word indexes). The file can be loaded without unpickling any Python objects.
+        :param path: Output .npz file path
+        :param meta: Dictionary of extra JSON-serializable metadata (e.g. pipeline label)
+        :return: self
+        """
+        pfam_ids, word_indexes = self._get_vocabulary_words()
+        vocabulary = getattr(self, 'vocabulary', None)
+        info = {
+            'format_version': HMM_NPZ_FORMAT_VERSION,
+            'type': type(self).__name__,
+            'vocabulary': vocabulary if isinstance(vocabulary, str) else None,
+            'params': self._get_npz_params(),
+            'meta': meta or {}
+        }
+        save_npz(path, {
+            'info': np.array(json.dumps(info)),
+            'startprob': self.model_.startprob_,
+            'transmat': self.model_.transmat_,
+            'emissionprob': self.model_.emissionprob_,
+            'pfam_ids': np.array(pfam_ids, dtype=str),
+            'word_indexes': np.asarray(word_indexes, dtype=np.int64),
+            **self._get_npz_arrays()
+        })
+        return self
+
+    @classmethod
+    def load_npz(cls, path, mmap=True):
+        """
+        Load model saved using save_npz, the model class is taken from the file
+        :param path: Path to .npz file
+        :param mmap: Memory-map the probability arrays instead of reading them to memory
+        :return: Tuple of (trained model, metadata dictionary)
+        """
+        arrays = load_npz(path, mmap=mmap)
+        info = json.loads(str(arrays['info']))
+        if info['format_version'] != HMM_NPZ_FORMAT_VERSION:
+            raise ValueError('Unsupported HMM NPZ format version {} in {}'.format(info['format_version'], path))
+        model_class = getattr(sys.modules[__name__], info['type'])
+        if not issubclass(model_class, cls):
+            raise AttributeError('File {} contains {}, expected {}'.format(path, info['type'], cls.__name__))
+        model = model_class(vocabulary=info['vocabulary'])
+        model.model_ = DiscreteHMMParams(arrays['startprob'], arrays['transmat'], arrays['emissionprob'])
+        model._set_vocabulary_words(arrays['pfam_ids'].astype(object), arrays['word_indexes'])
+        model._set_npz_params(info['params'])
+        model._set_npz_arrays(arrays)
+        model._lookup = None
+        return model, info['meta']
+
+    def _get_npz_params(self):
+        """
+        Get dictionary of extra fitted attributes stored in the NPZ file
+        """
+        return {}
+
+    def _set_npz_params(self, params):
+        for name, value in params.items():
+            setattr(self, name, value)
+
+    def _get_npz_arrays(self):
+        """
+        Get dictionary of extra arrays stored in the NPZ file
+        """
+        return {}
+
+    def _set_npz_arrays(self, arrays):
+        pass
+
+
+def _get_count_arrays(counts, default_emission_count):
+    """
+    Get NPZ arrays of emission counts stored by DiscreteHMM.fit, see DiscreteHMM.partial_fit
+    """
+    if counts is None:
+        return {}
+    return {
+        'counts': np.array(counts[['neg', 'pos']].values, dtype=np.float64),
+        'count_pfam_ids': np.array(counts.index, dtype=str),
+        'default_emission_count': np.array(default_emission_count, dtype=np.float64)
+    }
+
+
+def _read_count_arrays(arrays):
+    """
+    Read emission counts stored using _get_count_arrays
+    :return: Tuple of (counts DataFrame, default emission count), (None, None) if counts are not stored
+    """
+    if 'counts' not in arrays:
+        return None, None
+    counts = np.array(arrays['counts'])
+    pfam_ids = pd.Index(arrays['count_pfam_ids'].astype(object), name='pfam_id')
+    return pd.DataFrame({'pos': counts[:, 1], 'neg': counts[:, 0]}, index=pfam_ids), float(arrays['default_emission_count'])
+
 
 class DiscreteHMM(HMM):
 
@@ -34,34 +292,48 @@ class DiscreteHMM(HMM):
         :param X: DataFrame of domains with pfam_id column
         :return: numpy array of numbers representing given words in our vocabulary
         """
-        return np.array([self.vocabulary_.get(o, -1) for o in X['pfam_id']])
+        word_indexes, known = self._get_word_indexes(X)
+        return word_indexes
 
-    def predict(self, X: pd.DataFrame):
-        """
-        Get BGC prediction score for a Domain DataFrame
-        :param X: DataFrame with pfam domains
-        :return: numpy array of BGC prediction scores for each domain in X
-        """
-        word_vector = self.get_sample_vector(X)
-        # Predict posterior probability using our HMM
-        logprob, posteriors = self.model_.score_samples(word_vector.reshape(-1, 1))
+    def _get_vocabulary_words(self):
+        return list(self.vocabulary_.keys()), list(self.vocabulary_.values())
+
+    def _set_vocabulary_words(self, pfam_ids, word_indexes):
+        self.vocabulary_ = dict(zip(pfam_ids, word_indexes.tolist()))
+
+    def _get_npz_arrays(self):
+        return _get_count_arrays(getattr(self, 'counts_', None), getattr(self, 'default_emission_count_', None))
+
+    def _set_npz_arrays(self, arrays):
+        counts, default_emission_count = _read_count_arrays(arrays)
+        if counts is not None:
+            self.counts_ = counts
+            self.default_emission_count_ = default_emission_count
+
+    def _get_prediction(self, posteriors):
         # BGC state probability is in second column
         return posteriors[:,1]
 
-    def _get_pfam_counts(self, X, y):
+    def _get_pfam_counts(self, X_list, y_list, sample_weights=None):
         """
-        Get number of occurences of each pfam ID in negative (non-BGC) and positive (BGC) states
-        :param X: Domain DataFrame with pfam_id column
-        :param y: Series of states for each domain (0 = non-BGC, 1 = BGC)
-        :return: DataFrame with number of positive and negative occurences (pos and neg columns) of each pfam_id (index).
+        Get (weighted) number of occurences of each pfam ID in negative (non-BGC) and positive (BGC) states.
+        Pfam IDs of all samples are integer-coded at once and counted in a single bincount pass.
+        :param X_list: List of Domain DataFrames with pfam_id column
+        :param y_list: List of Series of states for each domain (0 = non-BGC, 1 = BGC)
+        :param sample_weights: List of sample weights, weight of each sample is added for each of its domains. 1 if not provided.
+        :return: DataFrame with number of positive and negative occurences (pos and neg columns) of each pfam_id (index), sorted by pfam_id.
         """
-        counts = X[['pfam_id']].drop_duplicates().set_index('pfam_id')
-        unique_y = set(y)
-        if unique_y != {0, 1}:
+        lengths = [len(X) for X in X_list]
+        y = np.concatenate([np.asarray(y) for y in y_list])
+        if len(y) != sum(lengths):
+            raise AttributeError('Number of target values {} does not match number of domains {}'.format(len(y), sum(lengths)))
+        unique_y = set(np.unique(y))
+        if not unique_y <= {0, 1}:
             raise AttributeError('Invalid target values, expected {0, 1} got '+str(unique_y))
-        counts['pos'] = X[y == 1]['pfam_id'].value_counts()
-        counts['neg'] = X[y == 0]['pfam_id'].value_counts()
-        return counts.fillna(0)
+        codes, pfam_ids = pd.factorize(np.concatenate([X['pfam_id'].values for X in X_list]), sort=True)
+        weights = None if sample_weights is None else np.repeat(np.asarray(sample_weights, dtype=np.float64), lengths)
+        counts = count_emissions(codes, y, weights=weights, num_symbols=len(pfam_ids))
+        return pd.DataFrame({'pos': counts[:, 1], 'neg': counts[:, 0]}, index=pd.Index(pfam_ids, name='pfam_id'))
 
     def _construct_model(self, startprob, transmat, emissionprob, vocabulary):
         """
@@ -72,15 +344,9 @@ class DiscreteHMM(HMM):
         :param vocabulary: Vocabulary dictionary with {pfam_id: index_number_in_emission}
         :return: self
         """
-        self.model_ = hmm.MultinomialHMM(n_components=2)
-        if isinstance(startprob, list):
-            startprob = np.array(startprob)
-        if isinstance(transmat, list):
-            transmat = np.array(transmat)
-        self.model_.startprob_ = startprob
-        self.model_.transmat_ = transmat
-        self.model_.emissionprob_ = emissionprob
+        self.model_ = DiscreteHMMParams(startprob, transmat, emissionprob)
         self.vocabulary_ = vocabulary
+        self._lookup = None
         return self
 
     def fit(self, X_list, y_list, sample_weights=None, startprob=None, transmat=None, verbose=0,
@@ -108,14 +374,9 @@ class DiscreteHMM(HMM):
         if transmat is None:
             raise ValueError('Calculating transition matrix not supported yet, specify transmat explicitly')
 
-        if sample_weights is not None:
-            zipped = enumerate(zip(X_list, y_list, sample_weights))
-            weighted_counts = [self._get_pfam_counts(X, y) * weight for i, (X, y, weight) in zipped]
-            all_counts = pd.concat(weighted_counts).reset_index().groupby('pfam_id').sum().sort_index()
-        else:
-            X: pd.DataFrame = pd.concat(X_list)
-            y: pd.DataFrame = pd.concat(y_list)
-            all_counts = self._get_pfam_counts(X, y).sort_index()
+        all_counts = self._get_pfam_counts(X_list, y_list, sample_weights=sample_weights)
+        if not (all_counts[['neg', 'pos']].values.sum(axis=0) > 0).all():
+            raise AttributeError('Invalid target values, both negative (0) and positive (1) domains are required')
 
         if verbose:
             print('Top positive:')
@@ -123,20 +384,66 @@ class DiscreteHMM(HMM):
             print('Top negative:')
             print(all_counts.sort_values(by='neg', ascending=False).head(3))
 
+        # Raw counts are kept so that the emissions can be updated using partial_fit
+        self.counts_ = all_counts
+        self.default_emission_count_ = default_emission_count
+        emissions, vocabulary = self._get_emissions(all_counts, default_emission_count)
+        self._construct_model(startprob, transmat, emissions, vocabulary)
+        return self
+
+    def partial_fit(self, X_list, y_list, sample_weights=None, remove=False, verbose=0):
+        """
+        Update emission probability with emission counts of given samples, without recounting the original training samples.
+        Starting and transition probability are kept. Pfam IDs whose counts are removed completely are removed from the vocabulary.
+
+        :param X_list: List of samples (Domain DataFrames)
+        :param y_list: List of sample states (0 or 1), one value for each domain
+        :param sample_weights: List of sample weights, as in fit. If not provided, will be set to 1 for all samples.
+        :param remove: Remove counts of given samples (that were previously added) instead of adding them
+        :param verbose: Verbosity
+        :return: self
+        """
+        if getattr(self, 'counts_', None) is None:
+            raise AttributeError('Model does not store its emission counts, train it using fit first')
+        counts = self._get_pfam_counts(X_list, y_list, sample_weights=sample_weights)
+        if remove:
+            counts = -counts
+        updated = self.counts_.add(counts, fill_value=0).sort_index()
+        # Ignore rounding errors of weighted counts
+        updated[updated.abs() < 1e-9] = 0
+        if (updated.values < 0).any():
+            raise ValueError('Cannot remove more domains than were added, check that the removed samples were used in training')
+        updated = updated[(updated['neg'] > 0) | (updated['pos'] > 0)]
+        if not (updated[['neg', 'pos']].values.sum(axis=0) > 0).all():
+            raise ValueError('Updated counts have to contain both negative and positive domains')
+        if verbose:
+            print('{} {} domains, vocabulary size {} -> {}'.format(
+                'Removed' if remove else 'Added', sum(len(X) for X in X_list), len(self.counts_), len(updated)))
+
+        self.counts_ = updated
+        emissions, vocabulary = self._get_emissions(updated, self.default_emission_count_)
+        self._construct_model(self.model_.startprob_, self.model_.transmat_, emissions, vocabulary)
+        return self
+
+    def _get_emissions(self, counts, default_emission_count):
+        """
+        Get emission probability matrix and vocabulary from emission counts
+        :param counts: DataFrame with number of positive and negative occurences (pos and neg columns) of each pfam_id (index), sorted by pfam_id.
+        :param default_emission_count: Emission value for the other state for pfams that appear only in the positive / negative state
+        :return: Tuple of (emission probability matrix with a row for each state, vocabulary dictionary {pfam_id: index_number_in_emission})
+        """
         # For a pfam_id that appears only in the positive / negative state, set the default emission count instead of 0
-        all_counts.replace(0, default_emission_count, inplace=True)
+        counts = counts.replace(0, default_emission_count)
 
         # Vocabulary stores map of pfam_id -> index in emission vector
-        vocabulary = {pfam_id: i for i, pfam_id in enumerate(all_counts.index)}
+        vocabulary = {pfam_id: i for i, pfam_id in enumerate(counts.index)}
 
-        emissions = all_counts[['neg', 'pos']].values
+        emissions = np.array(counts[['neg', 'pos']].values, dtype=np.float64)
         # Divide each state's emission counts by the total number of observations to get emission frequency
         emissions /= emissions.sum(axis=0)
         # Add default emissions for unseen pfam_ids to the end (will be indexed by -1)
         emissions = np.concatenate([emissions, np.array([[0.5, 0.5]])])
-
-        self._construct_model(startprob, transmat, emissions.T, vocabulary)
-        return self
+        return emissions.T, vocabulary
 
     def get_sample_emissions(self, sample):
         word_index = self.get_sample_vector(sample)
@@ -165,16 +472,19 @@ class GeneBorderHMM(HMM):
         #print('Converted to four state start probability:')
         #print(self.model.startprob_)
 
-    def _convert_transmat(self, transmat, X_list, verbose=0):
+    def _count_gene_ends(self, X_list):
+        """
+        Count domains at gene ends and all domains in given samples
+        :return: Tuple of (number of domains at gene ends, number of all domains)
+        """
+        num_gene_end = sum([int(get_sample_gene_ends(X['protein_id']).sum()) for X in X_list])
+        num_total = sum([len(X) for X in X_list])
+        return num_gene_end, num_total
+
+    def _convert_transmat(self, transmat, frac_in_gene_end, verbose=0):
         if transmat is None:
             return
 
-        num_gene_end = sum([sum(get_sample_gene_ends(X['protein_id'])) for X in X_list])
-        num_total = sum([len(X) for X in X_list])
-        frac_in_gene_end = num_gene_end / num_total
-        if verbose:
-            print('Gene end: {} ({}/{})'.format(frac_in_gene_end, num_gene_end, num_total))
-
         # Transition probability
         out2bgc = transmat[0][1] * frac_in_gene_end
         out2out = 1 - out2bgc
@@ -214,22 +524,179 @@ class GeneBorderHMM(HMM):
 
         return emissionprob,  vocabulary
 
-    def _get_word_index(self, pfam_id, is_gene_end):
-        default_index = -1 if is_gene_end else -2
-        return self.vocabulary_.get((pfam_id, is_gene_end), default_index)
-
-    def get_sample_vector(self, X):
-        is_gene_end = get_sample_gene_ends(X['protein_id'])
-        if not any(is_gene_end):
-            print('Warning: no gene end predicted: '+str(X.head(1)))
-        return np.array([self._get_word_index(x, is_gene_end[i]) for i, x in enumerate(X['pfam_id'].values)])
+    def _get_vocabulary_words(self):
+        # Word index of each pfam ID not at gene end, gene end words are shifted by the number of pfam IDs
+        pfam_ids = [pfam_id for pfam_id, is_gene_end in self.vocabulary_.keys() if not is_gene_end]
+        return pfam_ids, [self.vocabulary_[(pfam_id, False)] for pfam_id in pfam_ids]
+
+    def _set_vocabulary_words(self, pfam_ids, word_indexes):
+        num_words = len(pfam_ids)
+        self.vocabulary_ = {}
+        for pfam_id, word_index in zip(pfam_ids, word_indexes.tolist()):
+            self.vocabulary_[(pfam_id, False)] = word_index
+            self.vocabulary_[(pfam_id, True)] = word_index + num_words
+
+    def _get_npz_params(self):
+        frac_in_gene_end = getattr(self, 'frac_in_gene_end_', None)
+        params = {} if frac_in_gene_end is None else {'frac_in_gene_end_': float(frac_in_gene_end)}
+        if getattr(self, 'two_state_model_', None) is not None:
+            params['num_gene_end_'] = int(self.num_gene_end_)
+            params['num_domains_'] = int(self.num_domains_)
+        return params
+
+    def _get_npz_arrays(self):
+        if getattr(self, 'two_state_model_', None) is None:
+            return {}
+        return self.two_state_model_._get_npz_arrays()
+
+    def _set_npz_arrays(self, arrays):
+        counts, default_emission_count = _read_count_arrays(arrays)
+        if counts is None:
+            return
+        # Restore the two state model used by partial_fit, its emissions are calculated from the counts
+        two_state_model = DiscreteHMM(vocabulary=self.vocabulary)
+        two_state_model.counts_ = counts
+        two_state_model.default_emission_count_ = default_emission_count
+        startprob, transmat = self.get_two_state_params()
+        emissions, vocabulary = two_state_model._get_emissions(counts, default_emission_count)
+        two_state_model._construct_model(startprob, transmat, emissions, vocabulary)
+        self.two_state_model_ = two_state_model
+
+    def get_sample_vector(self, X, is_gene_end=None):
+        """
+        Turn pfam IDs into integers based on our vocabulary, pfam IDs at gene ends are shifted by the number of pfam IDs
+        :param X: DataFrame of domains with pfam_id and protein_id column
+        :param is_gene_end: Boolean array marking domains at gene ends, calculated from protein_id if not provided
+        :return: numpy array of numbers representing given words in our vocabulary
+        """
+        if is_gene_end is None:
+            is_gene_end = get_sample_gene_ends(X['protein_id'])
+            if not any(is_gene_end):
+                print('Warning: no gene end predicted: '+str(X.head(1)))
+        word_indexes, known = self._get_word_indexes(X)
+        num_words = len(self.vocabulary_) // 2
+        # Unknown pfam IDs use the default emission, -1 at gene ends and -2 inside genes
+        default_indexes = np.where(is_gene_end, -1, -2)
+        return np.where(known, word_indexes + np.where(is_gene_end, num_words, 0), default_indexes)
+
+    def _get_protein_params(self, model=None):
+        """
+        Get two state (OUT, BGC) model of proteins equivalent to the four state model of domains.
+        Inside a protein the state cannot change and each domain step has the same 0.5 probability of (not) being at gene end,
+        which is a constant factor for all state paths. Transitions between proteins are taken from the gene end states.
+        :param model: Four state DiscreteHMMParams, self.model_ if not provided
+        :return: Tuple of (starting probability, transition matrix)
+        """
+        model = model or self.model_
+        startprob = model.startprob_[0::2] + model.startprob_[1::2]
+        transmat = model.transmat_[1::2, 0::2] + model.transmat_[1::2, 1::2]
+        return startprob, transmat
 
-    def predict(self, X):
-        sample_vector = self.get_sample_vector(X)
-        prev_level = np.geterr()['divide']
-        np.seterr(divide='ignore')
-        logprob, posteriors = self.model_.score_samples(sample_vector.reshape(-1, 1))
-        np.seterr(divide=prev_level)
+    def _get_protein_frames(self, X_list):
+        """
+        Get product of emission probabilities of all domains of each protein in the OUT and BGC state
+        :param X_list: List of Domain DataFrames
+        :return: Tuple of (protein probability matrix, number of proteins of each sample, protein index of each domain,
+        matrix with the in-gene or gene-end OUT and BGC state of each domain)
+        """
+        lengths = [len(X) for X in X_list]
+        X = pd.concat(X_list, ignore_index=True)
+        sample_ends = np.cumsum(lengths) - 1
+        is_gene_end = np.append(X['protein_id'].values[:-1] != X['protein_id'].values[1:], True)
+        is_gene_end[sample_ends] = True
+        protein_probs, protein_sizes, states = self._get_protein_probs(X, is_gene_end)
+        protein_lengths = np.diff(np.concatenate([[0], np.cumsum(is_gene_end)[sample_ends]]))
+        domain_protein = np.repeat(np.arange(len(protein_sizes)), protein_sizes)
+        return protein_probs, protein_lengths, domain_protein, states
+
+    def _get_protein_probs(self, X, is_gene_end):
+        """
+        Get product of emission probabilities of all domains of each protein, the last domain has to be a gene end
+        :param X: DataFrame of domains
+        :param is_gene_end: Boolean array marking domains at gene ends
+        :return: Tuple of (protein probability matrix, number of domains of each protein, in-gene or gene-end OUT and BGC state of each domain)
+        """
+        word_vector = self.get_sample_vector(X, is_gene_end)
+
+        # Emission of each domain in the OUT and BGC state, from the in-gene or gene-end row of the four state model
+        states = np.array([0, 2]) + is_gene_end[:, None]
+        domain_probs = self.model_.emissionprob_[states, word_vector[:, None]]
+
+        # Each protein ends at a gene end
+        protein_ends = np.flatnonzero(is_gene_end)
+        protein_starts = np.concatenate([[0], protein_ends[:-1] + 1])
+        protein_probs, _ = get_segment_probs(domain_probs, protein_starts)
+        return protein_probs, np.diff(np.concatenate([[-1], protein_ends])), states
+
+    def _get_frame_params(self):
+        return self._get_protein_params()
+
+    def _get_stream_frames(self, chunks):
+        # Domains of the last protein of a chunk are kept until the protein ends in one of the following chunks
+        pending = None
+        for X in chunks:
+            if pending is not None and len(pending):
+                X = pd.concat([pending, X], ignore_index=True)
+            if not len(X):
+                continue
+            protein_ids = X['protein_id'].values
+            is_gene_end = np.append(protein_ids[:-1] != protein_ids[1:], False)
+            num_complete = np.flatnonzero(is_gene_end)[-1] + 1 if is_gene_end.any() else 0
+            if num_complete:
+                protein_probs, protein_sizes, _ = self._get_protein_probs(X.iloc[:num_complete], is_gene_end[:num_complete])
+                yield protein_probs, protein_sizes
+            pending = X.iloc[num_complete:]
+        if pending is not None and len(pending):
+            is_gene_end = np.zeros(len(pending), dtype=bool)
+            is_gene_end[-1] = True
+            protein_probs, protein_sizes, _ = self._get_protein_probs(pending, is_gene_end)
+            yield protein_probs, protein_sizes
+
+    def _get_posteriors(self, X_list):
+        """
+        Get posterior probability of each of the four states for each domain in a list of samples.
+        Since the state can only change at gene ends, the forward-backward algorithm is run over proteins
+        with a two state model, using the product of emission probabilities of all domains of each protein.
+        Each domain gets the posterior probability of its protein in the in-gene or gene-end state given by its position.
+        :param X_list: List of Domain DataFrames
+        :return: List of posterior matrices (one row for each domain, one column for each state)
+        """
+        if not X_list:
+            return []
+        lengths = [len(X) for X in X_list]
+        protein_probs, protein_lengths, domain_protein, states = self._get_protein_frames(X_list)
+
+        startprob, transmat = self._get_protein_params()
+        protein_posteriors, _ = forward_backward(startprob, transmat, protein_probs, protein_lengths)
+
+        posteriors = np.zeros((len(domain_protein), 4))
+        domain_range = np.arange(len(domain_protein))
+        posteriors[domain_range, states[:, 0]] = protein_posteriors[domain_protein, 0]
+        posteriors[domain_range, states[:, 1]] = protein_posteriors[domain_protein, 1]
+        return split_frames(posteriors, lengths)
+
+    def get_emission_frames(self, X_list):
+        protein_probs, protein_lengths, domain_protein, states = self._get_protein_frames(X_list)
+        return protein_probs, protein_lengths, domain_protein
+
+    def get_transition_params(self, startprob, transmat):
+        frac_in_gene_end = getattr(self, 'frac_in_gene_end_', None)
+        if frac_in_gene_end is None:
+            raise AttributeError('Model was trained without storing the gene end fraction, train it again to change its transitions')
+        model = DiscreteHMMParams(self._convert_startprob(startprob), self._convert_transmat(transmat, frac_in_gene_end), self.model_.emissionprob_)
+        return self._get_protein_params(model)
+
+    def get_two_state_params(self):
+        frac_in_gene_end = getattr(self, 'frac_in_gene_end_', None)
+        if frac_in_gene_end is None:
+            raise AttributeError('Model was trained without storing the gene end fraction, train it again to get its two state transitions')
+        startprob, transmat = self.model_.startprob_, self.model_.transmat_
+        out2bgc = (transmat[1][2] + transmat[1][3]) / frac_in_gene_end
+        bgc2out = (transmat[3][0] + transmat[3][1]) / frac_in_gene_end
+        return np.array([startprob[0] + startprob[1], startprob[2] + startprob[3]]), \
+            np.array([[1 - out2bgc, out2bgc], [bgc2out, 1 - bgc2out]])
+
+    def _get_prediction(self, posteriors):
         # final prediction is maximum of the probability of the last two states
         prediction = posteriors[:,2:]
         return np.max(prediction, axis=1)
@@ -240,15 +707,45 @@ class GeneBorderHMM(HMM):
         if verbose:
             print('Training two state model...')
 
-        two_state_model = DiscreteHMM()
+        two_state_model = DiscreteHMM(vocabulary=self.vocabulary)
         two_state_model.fit(X_list, y_list, startprob=startprob, transmat=transmat, verbose=verbose)
 
-        emission, self.vocabulary_ = self._convert_emission(two_state_model.model_.emissionprob_, two_state_model.vocabulary_)
+        # The two state model and gene end counts are kept so that the model can be updated using partial_fit
+        self.two_state_model_ = two_state_model
+        self.num_gene_end_, self.num_domains_ = self._count_gene_ends(X_list)
+        return self._construct_from_two_state_model()
+
+    def partial_fit(self, X_list, y_list, remove=False, verbose=0):
+        """
+        Update emission probability and gene end frequency with given samples, without recounting the original training samples.
+        See DiscreteHMM.partial_fit.
+        :param X_list: List of samples (Domain DataFrames)
+        :param y_list: List of sample states (0 or 1), one value for each domain
+        :param remove: Remove counts of given samples (that were previously added) instead of adding them
+        :param verbose: Verbosity
+        :return: self
+        """
+        if getattr(self, 'two_state_model_', None) is None:
+            raise AttributeError('Model does not store its two state model, train it using fit first')
+        self.two_state_model_.partial_fit(X_list, y_list, remove=remove, verbose=verbose)
+        num_gene_end, num_domains = self._count_gene_ends(X_list)
+        sign = -1 if remove else 1
+        self.num_gene_end_ += sign * num_gene_end
+        self.num_domains_ += sign * num_domains
+        return self._construct_from_two_state_model()
+
+    def _construct_from_two_state_model(self):
+        """
+        Create the four state model from the two state model and gene end counts
+        :return: self
+        """
+        two_state = self.two_state_model_.model_
+        emission, self.vocabulary_ = self._convert_emission(two_state.emissionprob_, self.two_state_model_.vocabulary_)
+        self._lookup = None
 
-        self.model_ = hmm.MultinomialHMM(n_components=4)
-        self.model_.startprob_ = self._convert_startprob(startprob)
-        self.model_.transmat_ = self._convert_transmat(transmat, X_list)
-        self.model_.emissionprob_ = emission
+        self.frac_in_gene_end_ = self.num_gene_end_ / self.num_domains_
+        self.model_ = DiscreteHMMParams(self._convert_startprob(two_state.startprob_),
+                                        self._convert_transmat(two_state.transmat_, self.frac_in_gene_end_), emission)
         return self
 
     def get_sample_emissions(self, X):
@@ -266,6 +763,15 @@ class ClusterFinderHMM(DiscreteHMM):
     Wrapper that loads the ClusterFinder trained model from the pickled starting, transition and emission matrices.
     """
     def fit(self, X_unused, y_unused, param_dir=None, **kwargs):
+        """
+        Load the ClusterFinder model
+        :param param_dir: Directory with the ClusterFinder pickles, or .npz file converted from them using models/convert_clusterfinder.py
+        :return: self
+        """
+        if param_dir.endswith('.npz'):
+            model, _ = ClusterFinderHMM.load_npz(param_dir)
+            return self._construct_model(startprob=model.model_.startprob_, transmat=model.model_.transmat_,
+                                         emissionprob=model.model_.emissionprob_, vocabulary=model.vocabulary_)
 
         with open(os.path.join(param_dir, 'NewTS_all_B_index.pkl'), 'rb') as pfile:
             cf_vocabulary = pickle.load(pfile)
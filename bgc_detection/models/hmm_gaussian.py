@@ -5,6 +5,7 @@
 
 import pandas as pd
 from sklearn import mixture
+from scipy.special import logsumexp
 import numpy as np
 from sklearn.base import BaseEstimator, ClassifierMixin
 import pickle
@@ -12,11 +13,26 @@ from hmmlearn import hmm
 
 class GaussianHMM(BaseEstimator, ClassifierMixin):
 
-    def __init__(self, num_pos_means=5, num_neg_means=5, covariance_type="diag", meta=None):
+    def __init__(self, num_pos_means=5, num_neg_means=5, covariance_type="diag", meta=None,
+                 max_fit_vectors=None, batch_size=None, num_epochs=1, random_state=None):
+        """
+        :param num_pos_means: Number of mixture components of the positive (BGC) state
+        :param num_neg_means: Number of mixture components of the negative (non-BGC) state
+        :param covariance_type: Covariance type of the mixtures, see sklearn GaussianMixture
+        :param meta: Dictionary with extra model metadata
+        :param max_fit_vectors: Fit each mixture on a random subsample of at most given number of vectors
+        :param batch_size: Fit each mixture using mini-batch (stepwise) EM with given batch size (only for diag covariance type)
+        :param num_epochs: Number of passes through the vectors in mini-batch EM
+        :param random_state: Random seed used for subsampling and mini-batches
+        """
         self.num_pos_means = num_pos_means
         self.num_neg_means = num_neg_means
         self.covariance_type = covariance_type
         self.meta = meta or {}
+        self.max_fit_vectors = max_fit_vectors
+        self.batch_size = batch_size
+        self.num_epochs = num_epochs
+        self.random_state = random_state
 
     def predict(self, X):
         # Predict posterior probability using our HMM
@@ -37,15 +53,14 @@ class GaussianHMM(BaseEstimator, ClassifierMixin):
         pos_vectors = X[y == 1]
         neg_vectors = X[y == 0]
 
+        random = np.random.RandomState(self.random_state)
         if verbose:
             print('Training positive GMM on {} vectors'.format(len(pos_vectors)))
-        pos_gmm = mixture.GaussianMixture(n_components=self.num_pos_means, covariance_type=self.covariance_type)
-        pos_gmm.fit(pos_vectors)
+        pos_gmm = self._fit_gmm(pos_vectors, self.num_pos_means, random, verbose=verbose)
 
         if verbose:
             print('Training negative GMM on {} vectors'.format(len(neg_vectors)))
-        neg_gmm = mixture.GaussianMixture(n_components=self.num_neg_means, covariance_type=self.covariance_type)
-        neg_gmm.fit(neg_vectors)
+        neg_gmm = self._fit_gmm(neg_vectors, self.num_neg_means, random, verbose=verbose)
 
         self.model_ = GMMHMM2(n_components=2, covariance_type=self.covariance_type, verbose=bool(verbose))
         self.model_.startprob_ = startprob
@@ -53,6 +68,21 @@ class GaussianHMM(BaseEstimator, ClassifierMixin):
         self.model_.gmms_ = np.array([neg_gmm, pos_gmm])
         return self
 
+    def _fit_gmm(self, vectors, num_means, random, verbose=1):
+        """
+        Fit gaussian mixture of one state, on a subsample of the vectors and/or using mini-batch EM if configured
+        """
+        if self.max_fit_vectors and len(vectors) > self.max_fit_vectors:
+            vectors = vectors[np.sort(random.choice(len(vectors), self.max_fit_vectors, replace=False))]
+            if verbose:
+                print('Using random subsample of {} vectors'.format(len(vectors)))
+        if self.batch_size and len(vectors) > self.batch_size:
+            if self.covariance_type != 'diag':
+                raise ValueError('Mini-batch fitting is only supported for diag covariance type, got {}'.format(self.covariance_type))
+            return fit_diag_gmm_minibatch(vectors, num_means, self.batch_size, num_epochs=self.num_epochs, random=random, verbose=verbose)
+        gmm = mixture.GaussianMixture(n_components=num_means, covariance_type=self.covariance_type)
+        return gmm.fit(vectors)
+
     def save(self, path):
         pickle.dump(self, path)
         return self
@@ -88,4 +118,113 @@ class GMMHMM2(hmm.GMMHMM):
         self.gmms_ = []
 
     def _compute_log_likelihood(self, X):
+        if all(g.covariance_type in DIAG_COVARIANCE_TYPES for g in self.gmms_):
+            return diag_gmm_log_likelihood(X, get_diag_gmm_params(self.gmms_))
         return np.array([g.score_samples(X) for g in self.gmms_]).T
+
+
+DIAG_COVARIANCE_TYPES = ('diag', 'spherical')
+
+
+def get_diag_gmm_params(gmms):
+    """
+    Stack parameters of the components of multiple diagonal (or spherical) gaussian mixtures, one mixture for each state
+    :param gmms: List of fitted sklearn GaussianMixture models
+    :return: Tuple of (component means, component precision cholesky factors, component log weights with normalization constants,
+    index of first component of each state)
+    """
+    means = np.concatenate([g.means_ for g in gmms])
+    num_features = means.shape[1]
+    precisions_chol = np.concatenate([
+        np.repeat(g.precisions_cholesky_[:, None], num_features, axis=1) if g.covariance_type == 'spherical' else g.precisions_cholesky_
+        for g in gmms
+    ])
+    log_weights = np.concatenate([np.log(g.weights_) for g in gmms])
+    log_norm = log_weights + np.log(precisions_chol).sum(axis=1) - 0.5 * num_features * np.log(2 * np.pi)
+    state_starts = np.cumsum([0] + [len(g.means_) for g in gmms[:-1]])
+    return means, precisions_chol, log_norm, state_starts
+
+
+def diag_gmm_component_log_prob(X, means, precisions_chol, log_norm):
+    """
+    Weighted log probability of each vector in each diagonal gaussian component, computed using matrix products
+    :return: Matrix with a row for each vector and a column for each component
+    """
+    precisions = precisions_chol ** 2
+    # sum((x - mean)^2 * precision) expanded into x^2 * precision - 2 * x * mean * precision + mean^2 * precision
+    sq_dist = (X ** 2).dot(precisions.T) - 2 * X.dot((means * precisions).T) + (means ** 2 * precisions).sum(axis=1)
+    return log_norm - 0.5 * sq_dist
+
+
+def diag_gmm_log_likelihood(X, params):
+    """
+    Log likelihood of each vector in each state, all state mixtures are evaluated in one batched computation
+    :param X: Matrix of vectors
+    :param params: Stacked mixture parameters from get_diag_gmm_params
+    :return: Matrix with a row for each vector and a column for each state
+    """
+    means, precisions_chol, log_norm, state_starts = params
+    log_prob = diag_gmm_component_log_prob(np.asarray(X, dtype=np.float64), means, precisions_chol, log_norm)
+    # Log-sum-exp over the components of each state
+    state_max = np.maximum.reduceat(log_prob, state_starts, axis=1)
+    component_state = np.repeat(np.arange(len(state_starts)), np.diff(np.append(state_starts, log_prob.shape[1])))
+    summed = np.add.reduceat(np.exp(log_prob - state_max[:, component_state]), state_starts, axis=1)
+    return state_max + np.log(summed)
+
+
+def fit_diag_gmm_minibatch(vectors, num_means, batch_size, num_epochs=1, random=None, step_power=0.6, reg_covar=1e-6, verbose=1):
+    """
+    Fit diagonal gaussian mixture using mini-batch (stepwise) EM.
+    The mixture is initialized by a regular fit on one batch, then running averages of the sufficient statistics
+    (responsibilities, weighted sums of vectors and squared vectors) are updated with each batch, with step size (step + 2) ^ -step_power.
+    :param vectors: Matrix of vectors
+    :param num_means: Number of mixture components
+    :param batch_size: Number of vectors in each batch
+    :param num_epochs: Number of passes through the vectors
+    :param random: numpy RandomState used for shuffling
+    :param step_power: Step size decay power, between 0.5 and 1
+    :param reg_covar: Non-negative regularization added to the variances, as in sklearn GaussianMixture
+    :param verbose: Verbosity
+    :return: sklearn GaussianMixture with the fitted parameters
+    """
+    random = random or np.random.RandomState()
+    vectors = np.asarray(vectors, dtype=np.float64)
+    order = random.permutation(len(vectors))
+    gmm = mixture.GaussianMixture(n_components=num_means, covariance_type='diag', reg_covar=reg_covar,
+                                  random_state=random.randint(2 ** 31))
+    gmm.fit(vectors[order[:batch_size]])
+
+    weights, means, covariances = gmm.weights_, gmm.means_, gmm.covariances_
+    s0 = weights
+    s1 = weights[:, None] * means
+    s2 = weights[:, None] * (covariances + means ** 2)
+    step = 0
+    for epoch in range(num_epochs):
+        log_likelihood = 0
+        for start in range(0, len(order), batch_size):
+            batch = vectors[order[start:start + batch_size]]
+            log_prob = diag_gmm_component_log_prob(batch, means, 1 / np.sqrt(covariances),
+                                                   np.log(weights) - 0.5 * np.log(covariances).sum(axis=1) - 0.5 * batch.shape[1] * np.log(2 * np.pi))
+            log_total = logsumexp(log_prob, axis=1)
+            resp = np.exp(log_prob - log_total[:, None])
+            log_likelihood += log_total.sum()
+
+            eta = (step + 2) ** -step_power
+            s0 = (1 - eta) * s0 + eta * resp.mean(axis=0)
+            s1 = (1 - eta) * s1 + eta * resp.T.dot(batch) / len(batch)
+            s2 = (1 - eta) * s2 + eta * resp.T.dot(batch ** 2) / len(batch)
+            weights = s0 / s0.sum()
+            means = s1 / s0[:, None]
+            covariances = np.maximum(s2 / s0[:, None] - means ** 2, 0) + reg_covar
+            step += 1
+        if verbose:
+            print('Mini-batch EM epoch {}/{}: average log likelihood {:.3f}'.format(epoch + 1, num_epochs, log_likelihood / len(vectors)))
+        order = random.permutation(len(vectors))
+
+    gmm.weights_ = weights
+    gmm.means_ = means
+    gmm.covariances_ = covariances
+    gmm.precisions_cholesky_ = 1 / np.sqrt(covariances)
+    gmm.precisions_ = 1 / covariances
+    gmm.n_iter_ = step
+    return gmm
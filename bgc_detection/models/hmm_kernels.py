@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# Vectorized inference kernels for the discrete HMM models
+# Many sequences (contigs) are processed in one call: observations of all sequences are concatenated
+# and each time step is computed for all sequences at once, with the forward and backward pass reset at sequence boundaries.
+
+import numpy as np
+
+
+class DiscreteHMMParams(object):
+    """
+    Parameters of a discrete HMM, stored with the same attribute names as in hmmlearn models
+    """
+    def __init__(self, startprob, transmat, emissionprob):
+        """
+        :param startprob: Starting probability of each state
+        :param transmat: Transition matrix (An array where the [i][j]-th element corresponds to the probability of transitioning from the i-th to j-th state)
+        :param emissionprob: Emission probability matrix with a row for each state and a column for each symbol
+        """
+        self.startprob_ = np.asarray(startprob, dtype=np.float64)
+        self.transmat_ = np.asarray(transmat, dtype=np.float64)
+        self.emissionprob_ = np.asarray(emissionprob, dtype=np.float64)
+
+    @property
+    def n_components(self):
+        return len(self.startprob_)
+
+
+def get_frame_probs(emissionprob, symbols):
+    """
+    Get emission probability of each observed symbol in each state
+    :param emissionprob: Emission probability matrix with a row for each state and a column for each symbol
+    :param symbols: Array of observed symbols (negative symbols index from the end)
+    :return: Matrix with a row for each observation and a column for each state
+    """
+    return np.asarray(emissionprob).T[symbols]
+
+
+def count_emissions(symbols, states, weights=None, num_symbols=None, num_states=2):
+    """
+    Count (weighted) occurences of each symbol in each state in a single bincount pass
+    :param symbols: Array of integer-coded observed symbols
+    :param states: Array of integer state of each observation
+    :param weights: Weight of each observation, 1 for all observations if not provided
+    :param num_symbols: Number of symbols, calculated from the maximum symbol if not provided
+    :param num_states: Number of states
+    :return: Matrix of counts with a row for each symbol and a column for each state
+    """
+    symbols = np.asarray(symbols, dtype=np.int64)
+    states = np.asarray(states, dtype=np.int64)
+    if num_symbols is None:
+        num_symbols = symbols.max() + 1 if len(symbols) else 0
+    counts = np.bincount(symbols * num_states + states, weights=weights, minlength=num_symbols * num_states)
+    return counts.reshape(num_symbols, num_states).astype(np.float64)
+
+
+def forward_backward(startprob, transmat, frame_probs, lengths):
+    """
+    Scaled forward-backward algorithm run on multiple sequences at once.
+    Sequences are sorted by length, so that the sequences still active at each time step form a prefix
+    and each step is a single vectorized operation over all active sequences.
+    :param startprob: Starting probability of each state
+    :param transmat: Transition matrix
+    :param frame_probs: Emission probability of each observation (row) in each state (column), sequences concatenated
+    :param lengths: Length of each sequence
+    :return: Tuple of (posterior probability matrix with the same shape as frame_probs, log likelihood of each sequence)
+    """
+    frame_probs = np.asarray(frame_probs, dtype=np.float64)
+    transmat = np.asarray(transmat, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    num_frames, num_states = frame_probs.shape
+    if lengths.sum() != num_frames:
+        raise ValueError('Sequence lengths {} do not match number of observations {}'.format(lengths.sum(), num_frames))
+
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    order = np.argsort(-lengths, kind='stable')
+    sorted_starts = starts[order]
+    sorted_lengths = lengths[order]
+    max_length = sorted_lengths[0] if len(lengths) else 0
+    # Number of sequences still active at each time step
+    num_active = np.searchsorted(-sorted_lengths, -np.arange(max_length), side='left')
+
+    alpha = np.zeros((num_frames, num_states))
+    scale = np.zeros(num_frames)
+
+    # Forward pass, alpha of each frame is normalized to sum to 1
+    prev = None
+    for t in range(max_length):
+        active = num_active[t]
+        frames = sorted_starts[:active] + t
+        if t == 0:
+            current = startprob * frame_probs[frames]
+        else:
+            current = prev[:active].dot(transmat) * frame_probs[frames]
+        frame_scale = current.sum(axis=1)
+        current /= frame_scale[:, None]
+        alpha[frames] = current
+        scale[frames] = frame_scale
+        prev = current
+
+    # Backward pass, using the same scaling factors
+    beta = np.zeros((num_frames, num_states))
+    next_beta = None
+    for t in range(max_length - 1, -1, -1):
+        active = num_active[t]
+        frames = sorted_starts[:active] + t
+        current = np.ones((active, num_states))
+        # Sequences that continue after this step
+        num_continuing = num_active[t + 1] if t + 1 < max_length else 0
+        if num_continuing:
+            next_frames = frames[:num_continuing] + 1
+            current[:num_continuing] = (frame_probs[next_frames] * next_beta[:num_continuing]).dot(transmat.T) / scale[next_frames][:, None]
+        beta[frames] = current
+        next_beta = current
+
+    posteriors = alpha * beta
+    posteriors /= posteriors.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore'):
+        log_scale = np.log(scale)
+    log_likelihoods = np.bincount(np.repeat(np.arange(len(lengths)), lengths), weights=log_scale, minlength=len(lengths))
+    return posteriors, log_likelihoods
+
+
+def get_segment_probs(frame_probs, segment_starts):
+    """
+    Get emission probability of whole segments of consecutive observations (e.g. all domains of a protein),
+    computed as a sum of log emission probabilities to avoid underflow in long segments.
+    Each segment row is scaled so that its maximum is 1, the scale does not change posterior probabilities.
+    :param frame_probs: Emission probability of each observation (row) in each state (column)
+    :param segment_starts: Index of first observation of each segment
+    :return: Tuple of (matrix with a row for each segment and a column for each state, log scale of each segment)
+    """
+    with np.errstate(divide='ignore'):
+        log_probs = np.add.reduceat(np.log(frame_probs), segment_starts, axis=0)
+    log_scale = log_probs.max(axis=1)
+    return np.exp(log_probs - log_scale[:, None]), log_scale
+
+
+def viterbi(startprob, transmat, frame_probs, lengths):
+    """
+    Viterbi algorithm run on multiple sequences at once, in log space.
+    Sequences are sorted by length as in forward_backward, each step is a single vectorized operation over all active sequences.
+    :param startprob: Starting probability of each state
+    :param transmat: Transition matrix
+    :param frame_probs: Emission probability of each observation (row) in each state (column), sequences concatenated
+    :param lengths: Length of each sequence
+    :return: numpy array with the most likely state of each observation
+    """
+    frame_probs = np.asarray(frame_probs, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    num_frames, num_states = frame_probs.shape
+    if lengths.sum() != num_frames:
+        raise ValueError('Sequence lengths {} do not match number of observations {}'.format(lengths.sum(), num_frames))
+    with np.errstate(divide='ignore'):
+        log_startprob = np.log(startprob)
+        log_transmat = np.log(transmat)
+        log_frame_probs = np.log(frame_probs)
+
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    order = np.argsort(-lengths, kind='stable')
+    sorted_starts = starts[order]
+    sorted_lengths = lengths[order]
+    max_length = sorted_lengths[0] if len(lengths) else 0
+    num_active = np.searchsorted(-sorted_lengths, -np.arange(max_length), side='left')
+
+    # Forward pass, storing the best log probability and best previous state of each frame
+    delta = np.zeros((num_frames, num_states))
+    backpointers = np.zeros((num_frames, num_states), dtype=np.int64)
+    prev = None
+    for t in range(max_length):
+        active = num_active[t]
+        frames = sorted_starts[:active] + t
+        if t == 0:
+            current = log_startprob + log_frame_probs[frames]
+        else:
+            scores = prev[:active, :, None] + log_transmat
+            backpointers[frames] = scores.argmax(axis=1)
+            current = scores.max(axis=1) + log_frame_probs[frames]
+        delta[frames] = current
+        prev = current
+
+    # Backtracking, each sequence starts from its best last state
+    states = np.zeros(num_frames, dtype=np.int64)
+    current = np.zeros(len(lengths), dtype=np.int64)
+    for t in range(max_length - 1, -1, -1):
+        active = num_active[t]
+        frames = sorted_starts[:active] + t
+        ending = np.flatnonzero(sorted_lengths[:active] == t + 1)
+        current[ending] = delta[frames[ending]].argmax(axis=1)
+        states[frames] = current[:active]
+        current[:active] = backpointers[frames, current[:active]]
+    return states
+
+
+class FixedLagSmoother(object):
+    """
+    Fixed-lag forward-backward smoother of one unbounded sequence.
+    Posterior of each frame is calculated from all previous frames and a fixed number of following frames,
+    so only the last `lag` frames are kept in memory. With a lag longer than the sequence, the posteriors
+    are equal to the posteriors of the full forward-backward algorithm.
+    """
+    def __init__(self, startprob, transmat, lag):
+        """
+        :param startprob: Starting probability of each state
+        :param transmat: Transition matrix
+        :param lag: Number of following frames used for the posterior of each frame
+        """
+        if lag < 0:
+            raise ValueError('Lag has to be non-negative, got {}'.format(lag))
+        self.startprob = np.asarray(startprob, dtype=np.float64)
+        self.transmat = np.asarray(transmat, dtype=np.float64)
+        self.lag = lag
+        self.alpha = None
+        self.frame_probs = np.zeros((0, len(self.startprob)))
+        self.alphas = np.zeros((0, len(self.startprob)))
+
+    def push(self, frame_probs):
+        """
+        Add new frames to the sequence
+        :param frame_probs: Emission probability of each new frame (row) in each state (column)
+        :return: Posterior probability matrix of the frames that now have `lag` following frames (possibly empty)
+        """
+        frame_probs = np.asarray(frame_probs, dtype=np.float64)
+        alphas = np.zeros(frame_probs.shape)
+        alpha = self.alpha
+        for t, probs in enumerate(frame_probs):
+            alpha = (self.startprob if alpha is None else alpha.dot(self.transmat)) * probs
+            alpha /= alpha.sum()
+            alphas[t] = alpha
+        self.alpha = alpha
+        self.frame_probs = np.concatenate([self.frame_probs, frame_probs])
+        self.alphas = np.concatenate([self.alphas, alphas])
+
+        num_ready = max(len(self.frame_probs) - self.lag, 0)
+        if not num_ready:
+            return np.zeros((0, len(self.startprob)))
+        # Backward pass over the lag window, done for all ready frames at once
+        beta = np.ones((num_ready, len(self.startprob)))
+        ready = np.arange(num_ready)
+        for offset in range(self.lag, 0, -1):
+            beta = (self.frame_probs[ready + offset] * beta).dot(self.transmat.T)
+            beta /= beta.sum(axis=1, keepdims=True)
+        return self._pop_posteriors(num_ready, beta)
+
+    def flush(self):
+        """
+        End the sequence
+        :return: Posterior probability matrix of all remaining frames, calculated using all following frames
+        """
+        num_left = len(self.frame_probs)
+        beta = np.ones((num_left, len(self.startprob)))
+        for t in range(num_left - 2, -1, -1):
+            beta[t] = (self.frame_probs[t + 1] * beta[t + 1]).dot(self.transmat.T)
+            beta[t] /= beta[t].sum()
+        posteriors = self._pop_posteriors(num_left, beta)
+        self.alpha = None
+        return posteriors
+
+    def _pop_posteriors(self, num_frames, beta):
+        posteriors = self.alphas[:num_frames] * beta
+        posteriors /= posteriors.sum(axis=1, keepdims=True)
+        self.frame_probs = self.frame_probs[num_frames:]
+        self.alphas = self.alphas[num_frames:]
+        return posteriors
+
+
+def split_frames(values, lengths):
+    """
+    Split concatenated values of multiple sequences into a list with values of each sequence
+    """
+    return np.split(values, np.cumsum(lengths)[:-1])
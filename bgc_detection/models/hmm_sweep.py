@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Sweep of starting and transition probability of trained discrete HMM models
+# Emission probabilities of a set of samples are looked up once, each (startprob, transmat) setting
+# then only runs the forward-backward pass on the cached matrices and is scored using ROC AUC
+
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+from .hmm_kernels import forward_backward
+
+# Sweep used by the forked worker processes of TransitionSweep.evaluate_grid
+_sweep_state = None
+
+
+class TransitionSweep(object):
+    """
+    Evaluate many starting and transition probability settings of a trained HMM model on a fixed set of samples.
+    """
+    def __init__(self, model, X_list, y_list):
+        """
+        :param model: Trained DiscreteHMM, GeneBorderHMM or ClusterFinderHMM
+        :param X_list: List of Domain DataFrames
+        :param y_list: List of Series of states for each domain (0 = non-BGC, 1 = BGC)
+        """
+        if not hasattr(model, 'get_emission_frames'):
+            raise AttributeError('Model {} does not support transition sweeps'.format(type(model).__name__))
+        self.model = model
+        self.frame_probs, self.lengths, self.frame_index = model.get_emission_frames(X_list)
+        self.y = np.concatenate([np.asarray(y) for y in y_list])
+        if len(self.y) != len(self.frame_index):
+            raise AttributeError('Number of target values {} does not match number of domains {}'.format(len(self.y), len(self.frame_index)))
+
+    def predict(self, startprob, transmat):
+        """
+        Get BGC prediction score of each domain using given starting and transition probability
+        :param startprob: Starting probability [negative_starting_prob, positive_starting_prob]
+        :param transmat: Two state transition matrix
+        :return: numpy array of BGC prediction scores of all domains concatenated
+        """
+        frame_startprob, frame_transmat = self.model.get_transition_params(startprob, transmat)
+        posteriors, _ = forward_backward(frame_startprob, frame_transmat, self.frame_probs, self.lengths)
+        return posteriors[self.frame_index, 1]
+
+    def evaluate(self, startprob, transmat):
+        """
+        Evaluate given starting and transition probability
+        :return: Dictionary with the starting and transition probability of the BGC state and ROC AUC
+        """
+        prediction = self.predict(startprob, transmat)
+        return {
+            'start_bgc': startprob[1],
+            'out2bgc': transmat[0][1],
+            'bgc2out': transmat[1][0],
+            'roc_auc': roc_auc_score(self.y, prediction)
+        }
+
+    def evaluate_grid(self, params, n_jobs=1):
+        """
+        Evaluate list of settings, in parallel using forked worker processes that share the cached emission matrices
+        :param params: List of (startprob, transmat) tuples, see get_transition_grid
+        :param n_jobs: Number of worker processes
+        :return: DataFrame with one row for each setting, sorted by ROC AUC
+        """
+        global _sweep_state
+        params = list(params)
+        if n_jobs == 1 or len(params) == 1:
+            results = [self.evaluate(startprob, transmat) for startprob, transmat in params]
+        else:
+            _sweep_state = self
+            try:
+                with multiprocessing.get_context('fork').Pool(n_jobs) as pool:
+                    results = pool.starmap(_evaluate_task, params)
+            finally:
+                _sweep_state = None
+        return pd.DataFrame(results).sort_values(by='roc_auc', ascending=False).reset_index(drop=True)
+
+
+def _evaluate_task(startprob, transmat):
+    return _sweep_state.evaluate(startprob, transmat)
+
+
+def get_transition_grid(start_bgc_values, out2bgc_values, bgc2out_values):
+    """
+    Get all combinations of starting and transition probability of the BGC state
+    :param start_bgc_values: List of BGC starting probabilities
+    :param out2bgc_values: List of non-BGC to BGC transition probabilities
+    :param bgc2out_values: List of BGC to non-BGC transition probabilities
+    :return: List of (startprob, transmat) tuples
+    """
+    return [([1 - start_bgc, start_bgc], [[1 - out2bgc, out2bgc], [bgc2out, 1 - bgc2out]])
+            for start_bgc, out2bgc, bgc2out in itertools.product(start_bgc_values, out2bgc_values, bgc2out_values)]
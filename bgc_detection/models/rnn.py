@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
 from sklearn.base import BaseEstimator, ClassifierMixin
@@ -14,12 +15,13 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
         if trained_model is not None:
             self.model: Sequential = trained_model
             # Set the attributes from the model object to be able to clone and cross-validate a loaded model
+            first_lstm = [layer for layer in trained_model.layers if hasattr(layer, 'layer')][0]
             self.batch_size = trained_model.layers[0].batch_input_shape[0]
-            self.hidden_size = trained_model.layers[0].layer.units
-            self.stateful = trained_model.layers[0].layer.stateful
+            self.hidden_size = first_lstm.layer.units
+            self.stateful = first_lstm.layer.stateful
             self.loss = trained_model.loss
             self.activation = trained_model.layers[-1].layer.activation
-            self.return_sequences = trained_model.layers[0].layer.return_sequences
+            self.return_sequences = first_lstm.layer.return_sequences
         else:
             self.model: Sequential = None
             self.batch_size = batch_size
@@ -29,7 +31,8 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
             self.activation = activation
             self.return_sequences = return_sequences
 
-    def _build_model(self, input_size, stacked_sizes=None, fully_connected_sizes=None, optimizer_name=None, learning_rate=None, decay=None, gpus=0, custom_batch_size=None):
+    def _build_model(self, input_size, stacked_sizes=None, fully_connected_sizes=None, optimizer_name=None, learning_rate=None, decay=None, gpus=0, custom_batch_size=None,
+                     distributed=False, batch_metrics=True):
         """
         Build Keras Sequential model architecture with given parameters
         :param input_size: Dimensionality of input vector (number of features)
@@ -40,6 +43,8 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
         :param decay: Optimizer decay
         :param gpus: Number of gpus to train on (Not implemented)
         :param custom_batch_size: Use different batch size than self.batch_size
+        :param distributed: Wrap the optimizer in a Horovod DistributedOptimizer that averages gradients across workers
+        :param batch_metrics: Calculate batch-wise precision, recall and streaming AUC ROC in each training step, otherwise only accuracy is calculated
         :return: Keras Sequential model
         """
         from keras.layers.core import Dense
@@ -54,6 +59,11 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
 
         model = Sequential()
 
+        batch_input_shape = (custom_batch_size or self.batch_size, None, input_size)
+        input_layers = self._get_input_layers(batch_input_shape)
+        for layer in input_layers:
+            model.add(layer)
+
         model.add(Bidirectional(
             layer=LSTM(
                 units=self.hidden_size,
@@ -62,7 +72,7 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
                 recurrent_dropout=0.2,
                 stateful=self.stateful
             ),
-            batch_input_shape=(custom_batch_size or self.batch_size, None, input_size)
+            **({} if input_layers else {'batch_input_shape': batch_input_shape})
         ))
 
         for size in stacked_sizes:
@@ -93,15 +103,32 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
         else:
             optimizer = optimizer_name
 
+        if distributed:
+            import horovod.keras as hvd
+            optimizer = hvd.DistributedOptimizer(optimizers.get(optimizer))
+
+        metrics = ["accuracy"]
+        if batch_metrics:
+            metrics += [precision, recall, auc_roc]
+
         print('Using optimizer', optimizer_name, optimizer_args)
-        model.compile(loss=self.loss, optimizer=optimizer, sample_weight_mode='temporal', metrics=["accuracy", precision, recall, auc_roc])
+        model.compile(loss=self.loss, optimizer=optimizer, sample_weight_mode='temporal', metrics=metrics)
         return model
 
+    def _get_input_layers(self, batch_input_shape):
+        """
+        Get layers to add before the first Bi-LSTM layer, the first of them has to define the batch_input_shape.
+        :param batch_input_shape: Input shape of the model (batch_size, timesteps, input_size)
+        :return: List of Keras layers
+        """
+        return []
+
     def fit(self, X_list, y_list, timesteps=128, validation_size=0.33, num_epochs=10, verbose=1,
             debug_progress_path=None, fully_connected_sizes=None,
             shuffle=True, gpus=0, stacked_sizes=None, early_stop_mode=None, early_stop_monitor=None, early_stop_min_delta=0.005, early_stop_patience=10,
             positive_weight=None, weighted=False, optimizer=None, learning_rate=None, decay=None,
-            validation_X_list=None, validation_y_list=None):
+            validation_X_list=None, validation_y_list=None, distributed=False, timing=None, batch_metrics=True, epoch_auc=False,
+            balance_chunks=False, warm_start=False):
         """
         Train Keras Sequential model using provided list of positive / negative samples.
         Training is done in given number of epochs with additional stopping criteria.
@@ -119,7 +146,7 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
         :param gpus: Number of gpus to use (not implemented!)
         :param stacked_sizes: Add given number of additional Bi-LSTM layers after first Bi-LSTM layer, provided as list of sizes
         :param early_stop_mode: Keras early stopping mode (use max for increasing metrics like AUC ROC, use min for decreasing metrics like Loss)
-        :param early_stop_monitor: Metric to observe for early stopping (e.g. val_auc_roc)
+        :param early_stop_monitor: Metric to observe for early stopping (e.g. val_auc_roc or val_epoch_auc_roc)
         :param early_stop_min_delta: Minimum change to observed metric needed to continue training
         :param early_stop_patience: Number of epochs to get maximum value of the observed metric from, if that value does not improve over the previous maximum, stop training
         :param positive_weight: Weight of positive samples (single number). Can be used to counter imbalance in training data.
@@ -129,11 +156,29 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
         :param decay: Keras optimizer decay.
         :param validation_X_list: List of DataFrames (samples) used to observe validation performance
         :param validation_y_list: List of output values for validation samples, one value for each sample where 0 = negative sample (non-BGC), 1 = positive sample (BGC)
+        :param distributed: Train data-parallel in multiple processes using Horovod (launch using horovodrun or mpirun).
+        Each worker trains on its own shard of samples using the same stateful chunk layout, gradients are averaged across workers in each step.
+        :param timing: TimingLog where per-epoch wall time, throughput and training step vs batch wait time will be recorded
+        :param batch_metrics: Calculate batch-wise precision, recall and streaming AUC ROC metrics in each training step.
+        Disable to reduce the overhead of each step.
+        :param epoch_auc: Calculate AUC ROC and AUC PR of the whole validation set at the end of each epoch
+        (val_epoch_auc_roc and val_epoch_auc_pr), enabled automatically when used as early_stop_monitor.
+        :param balance_chunks: Split training samples into chunks with balanced number of domains instead of balanced number of samples,
+        which minimizes the zero padding of the chunks and the number of batches in each epoch.
+        :param warm_start: Start training from the weights of the already trained model instead of random weights.
+        The optimizer state is not preserved, consider using a lower learning_rate.
         :return: self
         """
 
         import keras
 
+        rank, num_workers = 0, 1
+        if distributed:
+            rank, num_workers = _init_distributed()
+            if rank != 0:
+                verbose = 0
+            print('Training as worker {} of {}'.format(rank + 1, num_workers))
+
         if not isinstance(X_list, list):
             raise AttributeError('Expected X_list to be list, got ' + str(type(X_list)))
 
@@ -151,11 +196,27 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
 
         input_size = X_list[0].shape[1]
 
-        train_model = self._build_model(input_size, stacked_sizes, fully_connected_sizes=fully_connected_sizes, optimizer_name=optimizer, learning_rate=learning_rate, decay=decay, gpus=gpus)
-        self.model = self._build_model(input_size, stacked_sizes, fully_connected_sizes=fully_connected_sizes, optimizer_name=optimizer, learning_rate=learning_rate, decay=decay, gpus=gpus, custom_batch_size=1)
+        initial_weights = None
+        if warm_start:
+            if self.model is None:
+                raise AttributeError('Cannot warm start an untrained model.')
+            initial_weights = self.model.get_weights()
+
+        train_model = self._build_model(input_size, stacked_sizes, fully_connected_sizes=fully_connected_sizes, optimizer_name=optimizer, learning_rate=learning_rate, decay=decay, gpus=gpus,
+                                        distributed=distributed, batch_metrics=batch_metrics)
+        self.model = self._build_model(input_size, stacked_sizes, fully_connected_sizes=fully_connected_sizes, optimizer_name=optimizer, learning_rate=learning_rate, decay=decay, gpus=gpus, custom_batch_size=1,
+                                       batch_metrics=batch_metrics)
+
+        if initial_weights is not None:
+            print('Starting from weights of the trained model')
+            train_model.set_weights(initial_weights)
+
+        if early_stop_monitor in ('val_epoch_auc_roc', 'val_epoch_auc_pr'):
+            epoch_auc = True
 
         X_train, y_train = X_list, y_list
         validation_data, validation_num_batches = None, None
+        epoch_auc_X_list, epoch_auc_y_list = validation_X_list, validation_y_list
 
         if validation_X_list:
             if positive_weight:
@@ -169,7 +230,10 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
             validation_num_batches = None
         elif validation_size:
             print('Validating on {:.1f}% of input set'.format(validation_size*100))
-            X_train, X_validation, y_train, y_validation = train_test_split(X_list, y_list, test_size=validation_size)
+            # All workers have to agree on the validation split
+            random_state = 0 if distributed else None
+            X_train, X_validation, y_train, y_validation = train_test_split(X_list, y_list, test_size=validation_size, random_state=random_state)
+            epoch_auc_X_list, epoch_auc_y_list = X_validation, y_validation
 
             get_validation_gen, validation_num_batches = _build_generator(
                 X_validation,
@@ -182,6 +246,16 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
             )
             validation_data = get_validation_gen()
 
+        train_num_batches = None
+        if distributed:
+            # Each worker takes one shard of samples with (approximately) the same number of domains.
+            # All workers have to run the same number of steps, so we use the number of batches of the longest shard.
+            shards = _split_balanced([X.shape[0] for X in X_train], num_workers)
+            train_num_batches = max(_get_num_batches([X_train[i].shape[0] for i in shard], self.batch_size, timesteps, balance_chunks=balance_chunks) for shard in shards)
+            X_train = [X_train[i] for i in shards[rank]]
+            y_train = [y_train[i] for i in shards[rank]]
+            print('Worker {} training on {} samples'.format(rank + 1, len(X_train)))
+
         get_train_gen, train_num_batches = _build_generator(
             X_train,
             y_train,
@@ -190,18 +264,37 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
             input_size=input_size,
             shuffle=shuffle,
             positive_weight=positive_weight,
+            num_batches=train_num_batches,
+            balance_chunks=balance_chunks
         )
         train_gen = get_train_gen()
 
 
         callbacks = []
-        if debug_progress_path:
+        if distributed:
+            import horovod.keras as hvd
+            # Start all workers from the same initial weights, average the epoch metrics so that early stopping is in sync
+            callbacks.append(hvd.callbacks.BroadcastGlobalVariablesCallback(0))
+            callbacks.append(hvd.callbacks.MetricAverageCallback())
+
+        if epoch_auc:
+            if not epoch_auc_X_list:
+                raise ValueError('Validation samples are needed to calculate epoch AUC, specify validation_size or validation samples.')
+            from .rnn_callbacks import EpochAUCCallback
+            # Add before other callbacks so that they can use the calculated metrics
+            callbacks.append(EpochAUCCallback(epoch_auc_X_list, epoch_auc_y_list, batch_size=self.batch_size, verbose=verbose))
+
+        if debug_progress_path and rank == 0:
             tb = keras.callbacks.TensorBoard(log_dir=debug_progress_path, histogram_freq=0, batch_size=self.batch_size,
                                              write_graph=True,
                                              write_grads=False, write_images=False,
                                              embeddings_layer_names=None, embeddings_metadata=None)
             callbacks.append(tb)
 
+        if timing is not None:
+            from .rnn_callbacks import TimingCallback
+            callbacks.append(TimingCallback(timing, domains_per_epoch=sum(X.shape[0] for X in X_train)))
+
         if early_stop_monitor:
             if not early_stop_mode:
                 raise ValueError('Keras early_stop_mode has to be specified (min, max, auto) to enable early_stop_monitor.')
@@ -234,11 +327,13 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
     def predict(self, X):
         """
         Predict given sample DataFrame/numpy matrix of numeric protein vectors
-        :param X: DataFrame/numpy matrix of protein vectors
+        :param X: DataFrame/numpy matrix (or scipy sparse matrix) of protein vectors
         :return: BGC prediction score for each protein vector
         """
         if len(X.shape) != 2:
             raise AttributeError('Can only be called on a single 2-dimensional feature matrix.')
+        if scipy.sparse.issparse(X):
+            X = X.toarray()
 
         if self.model is None:
             raise AttributeError('Cannot predict using untrained model.')
@@ -260,8 +355,8 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
     @classmethod
     def load(cls, path):
         import keras
-        model = keras.models.load_model(path, custom_objects={'precision': precision, 'recall': recall, 'auc_roc': auc_roc})
-        return KerasRNN(trained_model=model)
+        model = keras.models.load_model(path, custom_objects=_get_custom_objects())
+        return cls(trained_model=model)
 
     def __getstate__(self):
         """
@@ -288,9 +383,51 @@ class KerasRNN(BaseEstimator, ClassifierMixin):
         if architecture is None:
             self.model = None
         else:
-            self.model: Sequential = model_from_json(architecture)
+            self.model: Sequential = model_from_json(architecture, custom_objects=_get_custom_objects())
             self.model.set_weights(weights)
 
+
+class KerasEmbeddingRNN(KerasRNN):
+    """
+    LSTM wrapper that receives integer pfam codes instead of pfam2vec vectors and embeds them inside the model.
+    The first input column has to contain the codes produced by PfamCodeTransformer using the same pfam2vec file,
+    other columns (e.g. ProteinBorderTransformer flags) are passed to the Bi-LSTM unchanged.
+    """
+    def __init__(self, vector_path=None, fine_tune_embedding=False, trained_model=None, batch_size=1, hidden_size=128,
+                 loss='binary_crossentropy', stateful=True, activation='sigmoid', return_sequences=True):
+        """
+        :param vector_path: Path to pfam2vec .bin or .csv file used to initialize the embedding
+        :param fine_tune_embedding: Train the embedding vectors together with the model, otherwise they are frozen
+        """
+        super(KerasEmbeddingRNN, self).__init__(trained_model=trained_model, batch_size=batch_size, hidden_size=hidden_size,
+                                                loss=loss, stateful=stateful, activation=activation, return_sequences=return_sequences)
+        self.vector_path = vector_path
+        self.fine_tune_embedding = fine_tune_embedding
+        if trained_model is not None:
+            self.fine_tune_embedding = trained_model.layers[0].trainable
+
+    def _get_input_layers(self, batch_input_shape):
+        from .rnn_layers import PfamEmbedding
+        try:
+            from utils.features import read_pfam2vec
+        except ModuleNotFoundError:
+            from bgc_detection.utils.features import read_pfam2vec
+        if self.vector_path is None:
+            raise AttributeError('Specify vector_path to initialize the pfam2vec embedding.')
+        vectors = read_pfam2vec(self.vector_path).values
+        # Code 0 is used for unknown pfam IDs and padding
+        matrix = np.concatenate([np.zeros((1, vectors.shape[1])), vectors])
+        print('Embedding {} pfam2vec vectors of {} dimensions ({})'.format(
+            vectors.shape[0], vectors.shape[1], 'fine-tuned' if self.fine_tune_embedding else 'frozen'))
+        return [PfamEmbedding(
+            input_dim=matrix.shape[0],
+            output_dim=matrix.shape[1],
+            weights=[matrix],
+            trainable=self.fine_tune_embedding,
+            batch_input_shape=batch_input_shape
+        )]
+
+
 def rotate(l, n):
     m = n % len(l)
     return l[m:] + l[:m]
@@ -325,40 +462,53 @@ def _repeat_to_fill_batch_size(X_list, y_list, batch_size, input_size):
     y_filled = np.zeros(shape=(fill_shape[0], fill_shape[1], 1))
 
     for i in range(0, batch_size):
-        X_filled[i] = np.concatenate(rotate(X_list, i))[:max_len]
+        X_filled[i] = _concatenate_rows(rotate(X_list, i), max_len)
         y_filled[i][:,0] = np.concatenate(rotate(y_list, i))[:max_len]
 
     print('Filling done.')
     return X_filled, y_filled
 
 
-def _build_generator(X_list, y_list, batch_size, timesteps, input_size, shuffle, positive_weight):
+def _build_generator(X_list, y_list, batch_size, timesteps, input_size, shuffle, positive_weight, num_batches=None, balance_chunks=False):
     """
     Build looping generator of training batches. Will return the generator and the number of batches in each epoch.
     In each epoch, all samples are randomly split into batch_size "chunks", each "chunk" in batch can be trained in parallel.
+    By default, each chunk gets the same number of samples. With balance_chunks, samples are added one by one
+    (the longest samples first, equally long samples in random order) to the chunk with the lowest number of domains so far,
+    which minimizes the padding. The number of batches covers the longest chunk, so no chunk is truncated.
     Samples in each chunk are shuffled and merged into one whole sequence.
     The whole sequences are separated into batches of given fixed given number of timesteps (protein vectors).
     So the number of batches is defined so that we go over the whole sequence (length of the longest "chunk" sequence divided by the number of timesteps).
 
     :param X_list: List of samples. Each sample is a matrix/DataFrame of protein domain vectors.
+    Samples can also be scipy sparse matrices, in that case each batch is converted to a dense matrix only when it is generated.
     :param y_list: List of sample outputs.
     :param batch_size: Number of parallel "chunks" in a training batch
     :param timesteps: Number of timesteps (protein domain vectors) in a training batch
     :param input_size: Size of the protein domain vector
     :param shuffle: Whether to shuffle samples within each epoch. If not used, make sure that positive and negative samples are already shuffled in the list.
     :param positive_weight: Weight of positive samples (single number). If provided, a triple of (X_batch, y_batch, weights_batch) are provided
+    :param num_batches: Use given number of batches in each epoch instead of calculating it from the sequence length
+    :param balance_chunks: Balance the number of domains in each chunk instead of the number of samples
     :return: Tuple of (batch generator, number of batches in each epoch).
     Each batch will contain the X input (batch_size, timesteps, input_size) and y output (batch_size, timesteps, 1)
     """
     if not X_list:
         return _noop, None
     from keras.preprocessing.sequence import pad_sequences
-    seq_length = sum([len(X) for X in X_list])
-    X_arr = np.array(X_list)
-    y_arr = np.array(y_list)
-    num_batches = int(np.ceil(np.ceil(seq_length / batch_size) / timesteps))
+    lengths = [X.shape[0] for X in X_list]
+    seq_length = sum(lengths)
+    is_sparse = scipy.sparse.issparse(X_list[0])
+    X_arr = _to_object_array(X_list)
+    y_arr = _to_object_array(y_list)
+    if num_batches is None:
+        num_batches = _get_num_batches(lengths, batch_size, timesteps, balance_chunks=balance_chunks)
     maxlen = num_batches * timesteps
+    if balance_chunks:
+        base_chunks = _split_balanced(lengths, batch_size)
+    padding = 1 - min(seq_length / (maxlen * batch_size), 1)
     print('Initializing generator of {} batches from sequence length {}'.format(num_batches, seq_length))
+    print('Padding fraction: {:.2f}%{}'.format(padding * 100, '' if balance_chunks else ' (or more, chunks longer than {} are truncated)'.format(maxlen)))
 
     def generator():
         while True:
@@ -366,23 +516,33 @@ def _build_generator(X_list, y_list, batch_size, timesteps, input_size, shuffle,
             if shuffle:
                 shuffled = np.random.permutation(len(X_list))
             # split samples into batch_size chunks
-            X_batches = np.array_split(X_arr[shuffled] if shuffle else X_arr, batch_size)
-            y_batches = np.array_split(y_arr[shuffled] if shuffle else y_arr, batch_size)
+            if balance_chunks:
+                chunks = _get_epoch_chunks(lengths, base_chunks, batch_size, shuffle, maxlen)
+                X_batches = [X_arr[chunk] for chunk in chunks]
+                y_batches = [y_arr[chunk] for chunk in chunks]
+            else:
+                X_batches = np.array_split(X_arr[shuffled] if shuffle else X_arr, batch_size)
+                y_batches = np.array_split(y_arr[shuffled] if shuffle else y_arr, batch_size)
 
             # merge the samples in each chunk into one sequence
-            X_batches = [np.concatenate(b) if b.size else np.empty(0) for b in X_batches]
+            if is_sparse:
+                X_batches = _iterate_sparse_batches(X_batches, num_batches, timesteps, input_size)
+            else:
+                X_batches = [np.concatenate(b) if b.size else np.empty(0) for b in X_batches]
             y_batches = [np.concatenate(b) if b.size else np.empty(0) for b in y_batches]
 
             # pad the sequences with zeros to the length of the longest chunk sequence
-            X_batches = pad_sequences(X_batches, maxlen=maxlen, dtype=np.float,
-                                                                   padding='post', truncating='post')
+            if not is_sparse:
+                X_batches = pad_sequences(X_batches, maxlen=maxlen, dtype=np.float,
+                                                                       padding='post', truncating='post')
             y_batches = pad_sequences(y_batches, maxlen=maxlen, dtype=np.float,
                                                                    padding='post', truncating='post')
 
             # Reshape array so that it can be indexed as [batch number][chunk][timestep][input feature]
             # This will produce an array of dimension (num_batches, batch_size, timesteps, input_size)
             # And output array of dimension (num_batches, batch_size, timesteps, 1)
-            X_batches = np.swapaxes(X_batches.reshape(batch_size, num_batches, timesteps, input_size), 0, 1)
+            if not is_sparse:
+                X_batches = np.swapaxes(X_batches.reshape(batch_size, num_batches, timesteps, input_size), 0, 1)
             y_batches = np.swapaxes(y_batches.reshape(batch_size, num_batches, timesteps, 1), 0, 1)
 
             # print('Generated {}x{} batches: X {}, y {}'.format(num_batches, self.batch_size, X_batches.shape, y_batches.shape))
@@ -400,6 +560,118 @@ def _build_generator(X_list, y_list, batch_size, timesteps, input_size, shuffle,
 
     return generator, num_batches
 
+def _to_object_array(items):
+    """
+    Create array of objects that can be indexed by sample (numpy would merge equally long samples into one array
+    and does not create arrays of sparse matrices)
+    """
+    arr = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        arr[i] = item
+    return arr
+
+def _iterate_sparse_batches(chunks, num_batches, timesteps, input_size):
+    """
+    Merge sparse samples in each chunk into one sequence and generate dense batches one by one.
+    :param chunks: List of batch_size arrays of sparse sample matrices
+    :param num_batches: Number of batches, chunk sequences are padded with zeros or truncated to num_batches * timesteps
+    :param timesteps: Number of timesteps in a batch
+    :param input_size: Size of the protein domain vector
+    :return: Generator of dense (batch_size, timesteps, input_size) batches
+    """
+    merged = [scipy.sparse.vstack(list(chunk), format='csr') if chunk.size else None for chunk in chunks]
+    for b in range(num_batches):
+        X_batch = np.zeros((len(merged), timesteps, input_size))
+        for i, X in enumerate(merged):
+            if X is not None:
+                rows = X[b * timesteps:(b + 1) * timesteps]
+                X_batch[i, :rows.shape[0]] = rows.toarray()
+        yield X_batch
+
+def _concatenate_rows(X_list, max_len):
+    """
+    Concatenate list of numpy or scipy sparse matrices into a dense matrix trimmed to max_len rows.
+    """
+    if scipy.sparse.issparse(X_list[0]):
+        return scipy.sparse.vstack(X_list, format='csr')[:max_len].toarray()
+    return np.concatenate(X_list)[:max_len]
+
+def _get_num_batches(lengths, batch_size, timesteps, balance_chunks=False):
+    """
+    Get number of batches needed to go over all samples split into batch_size chunks
+    :param lengths: List of sample lengths (number of protein domains)
+    :param batch_size: Number of parallel "chunks" in a training batch
+    :param timesteps: Number of timesteps (protein domain vectors) in a training batch
+    :param balance_chunks: Whether samples are split into chunks using _get_balanced_chunks.
+    In that case, the number of batches covers the longest chunk of the longest-first layout (see _split_balanced),
+    each epoch uses a layout that fits into this number of batches (see _get_epoch_chunks).
+    Otherwise, the number of batches is based on the average chunk length.
+    :return: Number of batches in each epoch
+    """
+    if balance_chunks:
+        chunk_length = _get_max_chunk_length(lengths, _split_balanced(lengths, batch_size))
+    else:
+        chunk_length = np.ceil(sum(lengths) / batch_size)
+    return int(np.ceil(chunk_length / timesteps))
+
+def _get_max_chunk_length(lengths, chunks):
+    """
+    Get number of domains in the longest chunk
+    """
+    lengths = np.asarray(lengths)
+    return max([lengths[chunk].sum() if len(chunk) else 0 for chunk in chunks], default=0)
+
+def _get_epoch_chunks(lengths, base_chunks, batch_size, shuffle, maxlen):
+    """
+    Get chunks of samples for one epoch that fit into maxlen domains, so that no chunk is truncated.
+    A new random balanced layout is used if it fits (it nearly always does), otherwise the base layout is used.
+    :param lengths: List of sample lengths (number of protein domains)
+    :param base_chunks: Layout used to calculate the number of batches, see _get_num_batches
+    :param batch_size: Number of chunks
+    :param shuffle: Use a random layout and shuffle samples in each chunk, otherwise the base layout is used
+    :param maxlen: Maximum number of domains in a chunk
+    :return: List of batch_size arrays of sample indexes
+    """
+    if not shuffle:
+        return base_chunks
+    chunks = _get_balanced_chunks(lengths, batch_size)
+    if _get_max_chunk_length(lengths, chunks) > maxlen:
+        chunks = base_chunks
+    return [np.random.permutation(np.asarray(chunk, dtype=np.int64)) for chunk in chunks]
+
+def _get_balanced_chunks(lengths, batch_size):
+    """
+    Split samples into batch_size chunks with balanced number of domains, randomly.
+    Samples are added longest first, each to the shortest chunk so far, samples of equal length are added in random order.
+    :param lengths: List of sample lengths (number of protein domains)
+    :param batch_size: Number of chunks
+    :return: List of batch_size lists of sample indexes
+    """
+    lengths = np.asarray(lengths)
+    order = np.random.permutation(len(lengths))
+    order = order[np.argsort(-lengths[order], kind='stable')]
+    return _split_balanced(lengths, batch_size, order=order)
+
+def _split_balanced(lengths, num_bins, order=None):
+    """
+    Greedily split items into given number of bins with (approximately) equal total length.
+    Each item is added to the bin with the lowest total length so far.
+    :param lengths: List of item lengths
+    :param num_bins: Number of bins
+    :param order: Order in which to add the items, longest items first if not provided (deterministic)
+    :return: List of num_bins lists of item indexes
+    """
+    import heapq
+    if order is None:
+        order = np.argsort(-np.asarray(lengths), kind='stable')
+    bins = [[] for _ in range(num_bins)]
+    heap = [(0, b) for b in range(num_bins)]
+    for i in order:
+        total, b = heapq.heappop(heap)
+        bins[b].append(i)
+        heapq.heappush(heap, (total + lengths[i], b))
+    return bins
+
 def _count_samples(y_list, klass):
     return np.sum([np.mean(y == klass) for y in y_list])
 
@@ -417,6 +689,45 @@ def _pad_matrix_to_be_divisible(X, divisible_by):
     return pad_sequences([X], maxlen=maxlen, dtype=np.float, padding='post', truncating='post')[0]
 
 
+def _init_distributed():
+    """
+    Initialize Horovod and limit each worker to its share of the CPU cores of the node
+    :return: Tuple of (worker rank, number of workers)
+    """
+    import horovod.keras as hvd
+    import keras.backend as K
+    import multiprocessing
+    hvd.init()
+    threads = max(1, multiprocessing.cpu_count() // hvd.local_size())
+    config = tf.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=2)
+    K.set_session(tf.Session(config=config))
+    return hvd.rank(), hvd.size()
+
+
+def get_worker_rank():
+    """
+    Get rank of current Horovod worker, used to save results only once in distributed training.
+    :return: Rank of current worker, 0 if not training in distributed mode
+    """
+    import sys
+    hvd = sys.modules.get('horovod.keras')
+    if hvd is None:
+        return 0
+    try:
+        return hvd.rank()
+    except ValueError:
+        # Horovod has not been initialized
+        return 0
+
+
+def _get_custom_objects():
+    """
+    Get custom metrics and layers needed to load a saved Keras model
+    """
+    from .rnn_layers import PfamEmbedding
+    return {'precision': precision, 'recall': recall, 'auc_roc': auc_roc, 'PfamEmbedding': PfamEmbedding}
+
+
 def _get_device(gpus):
     if gpus == 0:
         return tf.device('/cpu:0')
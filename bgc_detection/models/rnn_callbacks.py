@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Keras callbacks used when training the KerasRNN model
+
+import time
+import numpy as np
+import scipy.sparse
+import keras
+
+
+class TimingCallback(keras.callbacks.Callback):
+    """
+    Measure wall time of each epoch, time spent in training steps and time spent waiting for the next batch.
+    Statistics are added to the given TimingLog at the end of each epoch.
+
+    Batches are generated by the fit_generator worker thread concurrently with the training steps,
+    so instead of the generator run time, the wait time is recorded: time between the end of a training step
+    and the start of the next one (or from the start of the epoch to the first step), measured in the training thread.
+    It includes the time the training loop waits for the next batch from the worker queue and the overhead of other callbacks.
+    """
+    def __init__(self, timing, domains_per_epoch):
+        """
+        :param timing: TimingLog where epoch statistics will be added
+        :param domains_per_epoch: Number of protein domains (excluding padding) that are processed in each epoch
+        """
+        super(TimingCallback, self).__init__()
+        self.timing = timing
+        self.domains_per_epoch = domains_per_epoch
+        self.wait_time = 0
+        self.step_time = 0
+        self.num_batches = 0
+        self.epoch_start = None
+        self.batch_start = None
+        self.batch_end = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.time()
+        self.batch_end = self.epoch_start
+        self.wait_time = 0
+        self.step_time = 0
+        self.num_batches = 0
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.time()
+        self.wait_time += self.batch_start - self.batch_end
+
+    def on_batch_end(self, batch, logs=None):
+        self.batch_end = time.time()
+        self.step_time += self.batch_end - self.batch_start
+        self.num_batches += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        wall_time = time.time() - self.epoch_start
+        self.timing.add_epoch(
+            epoch=epoch + 1,
+            wall_time=wall_time,
+            num_batches=self.num_batches,
+            batches_per_second=self.num_batches / wall_time,
+            domains_per_second=self.domains_per_epoch / wall_time,
+            wait_time=self.wait_time,
+            step_time=self.step_time,
+            metrics={k: float(v) for k, v in (logs or {}).items()}
+        )
+
+
+class EpochAUCCallback(keras.callbacks.Callback):
+    """
+    Calculate AUC ROC and AUC PR of the whole validation set once at the end of each epoch.
+    Adds 'val_epoch_auc_roc' and 'val_epoch_auc_pr' to the epoch logs, so that they can be monitored by early stopping.
+
+    All validation samples are merged into one sequence, split into batch_size chunks and predicted using a single batch.
+    Padding at the end of the last chunk is excluded from the evaluation.
+    When the validation outputs contain only one class, the metrics are not defined and NaN is logged instead.
+    """
+    def __init__(self, X_list, y_list, batch_size, verbose=1):
+        """
+        :param X_list: List of validation feature matrices (numpy or scipy sparse)
+        :param y_list: List of validation outputs
+        :param batch_size: Batch size of the trained model
+        :param verbose: Print the metrics at the end of each epoch
+        """
+        super(EpochAUCCallback, self).__init__()
+        X = scipy.sparse.vstack(X_list).toarray() if scipy.sparse.issparse(X_list[0]) else np.concatenate(X_list)
+        self.y_true = np.concatenate(y_list)
+        self.has_both_classes = len(np.unique(self.y_true)) > 1
+        if not self.has_both_classes:
+            print('Warning: Validation samples contain only one class, epoch AUC will be NaN')
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.num_domains = X.shape[0]
+        chunk_length = int(np.ceil(self.num_domains / batch_size))
+        X_padded = np.zeros((batch_size * chunk_length, X.shape[1]))
+        X_padded[:self.num_domains] = X
+        self.X_batch = X_padded.reshape(batch_size, chunk_length, X.shape[1])
+
+    def on_epoch_end(self, epoch, logs=None):
+        from sklearn.metrics import roc_auc_score, average_precision_score
+        logs = logs if logs is not None else {}
+        if not self.has_both_classes:
+            logs['val_epoch_auc_roc'] = np.nan
+            logs['val_epoch_auc_pr'] = np.nan
+            return
+        self.model.reset_states()
+        y_pred = self.model.predict(self.X_batch, batch_size=self.batch_size).reshape(-1)[:self.num_domains]
+        self.model.reset_states()
+        logs['val_epoch_auc_roc'] = roc_auc_score(self.y_true, y_pred)
+        logs['val_epoch_auc_pr'] = average_precision_score(self.y_true, y_pred)
+        if self.verbose:
+            print('Epoch {}: val_epoch_auc_roc: {:.4f} - val_epoch_auc_pr: {:.4f}'.format(
+                epoch + 1, logs['val_epoch_auc_roc'], logs['val_epoch_auc_pr']))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# Custom Keras layers used by the KerasRNN models
+
+import keras.backend as K
+from keras.layers import Layer
+
+
+class PfamEmbedding(Layer):
+    """
+    Replace integer pfam codes in the first input column by their embedding vectors, keep the other input columns.
+    Code 0 is used for unknown pfam IDs and padding and is always embedded as a zero vector.
+    """
+    def __init__(self, input_dim, output_dim, **kwargs):
+        """
+        :param input_dim: Number of embedded pfam codes (including code 0)
+        :param output_dim: Dimensionality of the embedding vectors
+        :param kwargs: Keras layer arguments, use weights=[matrix] to initialize the embedding and trainable=False to freeze it.
+        """
+        super(PfamEmbedding, self).__init__(**kwargs)
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+
+    def build(self, input_shape):
+        self.embeddings = self.add_weight(name='embeddings', shape=(self.input_dim, self.output_dim), initializer='zeros')
+        super(PfamEmbedding, self).build(input_shape)
+
+    def call(self, inputs):
+        codes = K.cast(inputs[:, :, 0], 'int32')
+        known = K.expand_dims(K.cast(codes > 0, K.floatx()))
+        vectors = K.gather(self.embeddings, codes) * known
+        return K.concatenate([vectors, inputs[:, :, 1:]], axis=-1)
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0], input_shape[1], self.output_dim + input_shape[2] - 1
+
+    def get_config(self):
+        config = {'input_dim': self.input_dim, 'output_dim': self.output_dim}
+        base_config = super(PfamEmbedding, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
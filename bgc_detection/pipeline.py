@@ -5,11 +5,17 @@
 try:
     import models
     from utils import features
+    from utils.timing import TimingLog
+    from utils.vocabulary import get_vocabulary
 except ModuleNotFoundError:
     from bgc_detection import models
     from bgc_detection.utils import features
+    from bgc_detection.utils.timing import TimingLog
+    from bgc_detection.utils.vocabulary import get_vocabulary
 import pickle
+import copy
 import json
+import inspect
 from sklearn.base import BaseEstimator, ClassifierMixin
 from pprint import pprint
 
@@ -32,7 +38,7 @@ class PipelineWrapper(BaseEstimator, ClassifierMixin):
         self.color = color
         self.label = label
 
-    def fit(self, samples, y, validation_samples=None, validation_y=None, **extra_fit_params):
+    def fit(self, samples, y, validation_samples=None, validation_y=None, timing=None, warm_start=False, **extra_fit_params):
         """
         Train model with given list of samples, observe performance on given validation samples.
         Domain DataFrames are converted to feature matrices using the pipeline's feature transformer.
@@ -40,6 +46,9 @@ class PipelineWrapper(BaseEstimator, ClassifierMixin):
         :param y: List of output values, one value for each sequence
         :param validation_samples: List of validation samples
         :param validation_y: List of validation sample outputs
+        :param timing: TimingLog where time of transformer fitting, feature transformation and model training will be recorded.
+        Passed also to the model if its fit function accepts it.
+        :param warm_start: Continue training of an already trained pipeline. Feature transformers are not refitted, model training starts from the trained model.
         :param extra_fit_params: Extra fitting parameters to pass to the fit function of given model
         :return: self
         """
@@ -47,20 +56,45 @@ class PipelineWrapper(BaseEstimator, ClassifierMixin):
             validation_y = []
         if validation_samples is None:
             validation_samples = []
+        if timing is None:
+            timing = TimingLog()
+        elif _accepts_param(self.model.fit, 'timing'):
+            extra_fit_params['timing'] = timing
+
+        if warm_start:
+            if not _accepts_param(self.model.fit, 'warm_start'):
+                raise AttributeError('Warm start is not supported by model {}'.format(type(self.model).__name__))
+            extra_fit_params['warm_start'] = True
+        else:
+            with timing.section('transformer_fit'):
+                self.transformer.fit(samples, y)
 
-        self.transformer.fit(samples, y)
-
-        train_X_list = self.transformer.transform(samples, y)
-        validation_X_list = self.transformer.transform(validation_samples, validation_y)
+        with timing.section('transform_train'):
+            train_X_list = self.transformer.transform(samples, y)
+        with timing.section('transform_validation'):
+            validation_X_list = self.transformer.transform(validation_samples, validation_y)
 
         merged_params = self.fit_params.copy()
         merged_params.update(extra_fit_params)
-        return self.model.fit(train_X_list, y, validation_X_list=validation_X_list, validation_y_list=validation_y, **merged_params)
+        with timing.section('model_fit'):
+            return self.model.fit(train_X_list, y, validation_X_list=validation_X_list, validation_y_list=validation_y, **merged_params)
 
     def predict(self, sample):
         X_list = self.transformer.transform(sample)
         return self.model.predict(X_list)
 
+    def predict_list(self, samples):
+        """
+        Get BGC prediction scores for a list of samples. Features of all samples are transformed together
+        and models that implement predict_list (e.g. the HMM models) predict all samples in one call.
+        :param samples: List of Domain DataFrames
+        :return: List of numpy arrays of BGC prediction scores for each domain
+        """
+        X_list = self.transformer.transform(samples)
+        if hasattr(self.model, 'predict_list'):
+            return self.model.predict_list(X_list)
+        return [self.model.predict(X) for X in X_list]
+
     @classmethod
     def from_config(cls, config, meta_only=False) -> 'PipelineWrapper':
         """
@@ -96,17 +130,62 @@ class PipelineWrapper(BaseEstimator, ClassifierMixin):
             transformer = None
         else:
             feature_params = input_params.get('features', [])
-            transformer = features.ListTransformer.from_config(feature_params)
+            transformer = features.ListTransformer.from_config(feature_params, n_jobs=input_params.get('n_jobs', 1))
 
         return PipelineWrapper(transformer=transformer, model=model, fit_params=fit_params, color=color, label=label)
 
-    def save(self, path) -> 'PipelineWrapper':
+    def save(self, path, slim=False, vocabulary=None) -> 'PipelineWrapper':
+        """
+        Save pipeline to a pickle file
+        :param path: Output pickle file path, HMM pipelines without feature transformers can be saved in the NPZ format using a .npz path
+        :param slim: Store tables of the feature transformers as compact numpy arrays without zero rows,
+        sharing equal arrays between transformers. Slim pipelines can be used for prediction, but cannot be trained further.
+        :param vocabulary: Only with slim, keep only table rows of pfam IDs in given PfamVocabulary, vocabulary JSON path or list of pfam IDs.
+        Other pfam IDs will be treated as unknown.
+        :return: self
+        """
+        if path.endswith('.npz'):
+            return self._save_npz(path)
+        pipeline = self
+        if slim:
+            pfam_ids = vocabulary
+            if vocabulary is not None and (isinstance(vocabulary, str) or hasattr(vocabulary, 'pfam_ids')):
+                pfam_ids = get_vocabulary(vocabulary).pfam_ids
+            pipeline = copy.copy(self)
+            pipeline.transformer = self.transformer.slim(pfam_ids)
+        elif vocabulary is not None:
+            raise AttributeError('Vocabulary can only be used together with slim=True')
         with open(path, 'wb') as f:
-            pickle.dump(self, f)
+            pickle.dump(pipeline, f)
+        return self
+
+    def _save_npz(self, path):
+        """
+        Save pipeline of an HMM model without feature transformers as a compact NPZ file (see HMM.save_npz)
+        """
+        if not hasattr(self.model, 'save_npz'):
+            raise AttributeError('NPZ format is not supported by model {}'.format(type(self.model).__name__))
+        if self.transformer is not None and self.transformer.transformers:
+            raise AttributeError('NPZ format does not support pipelines with feature transformers')
+        self.model.save_npz(path, meta={'fit_params': self.fit_params, 'color': self.color, 'label': self.label})
         return self
 
     @classmethod
     def load(cls, path) -> 'PipelineWrapper':
+        """
+        Load pipeline from a pickle file, or HMM pipeline from an NPZ file saved using save (memory-mapped)
+        """
+        if path.endswith('.npz'):
+            model, meta = models.hmm_discrete.HMM.load_npz(path)
+            return PipelineWrapper(transformer=features.ListTransformer([]), model=model, fit_params=meta.get('fit_params', {}),
+                                   color=meta.get('color'), label=meta.get('label'))
         with open(path, 'rb') as f:
             return pickle.load(f)
 
+
+def _accepts_param(func, name):
+    """
+    Check whether given function accepts a parameter with given name
+    """
+    return name in inspect.signature(func).parameters
+
@@ -32,9 +32,9 @@ def run_prediction(domains, pipeline, whole=False):
         samples = io.domains_to_samples(domains, 'contig_id')
         print('Predicting {} samples...'.format(len(samples)))
         predictions = []
-        for sample in samples:
+        for sample, sample_prediction in zip(samples, pipeline.predict_list(samples)):
             prediction = sample.copy()
-            prediction['prediction'] = pipeline.predict(sample)
+            prediction['prediction'] = sample_prediction
             predictions.append(prediction)
 
         merged: pd.DataFrame = pd.concat(predictions)
@@ -48,7 +48,7 @@ def run_prediction_task(args):
         pipeline = PipelineWrapper.load(MODEL_PATH)
         cache.pipeline = pipeline
 
-    domains = io.read_domains(path, options.maxevalue, None)
+    domains = io.read_domains(path, options.maxevalue, None, vocabulary=options.vocabulary)
     prediction = run_prediction(domains, pipeline, whole=options.whole)
     if options.avg:
         prediction = average_protein_prediction(prediction, prediction['prediction'])
@@ -75,6 +75,8 @@ if __name__ == '__main__':
                         help="Average protein prediction.")
     parser.add_argument("--whole", dest="whole", action='store_true',
                         help="Discard contig_id information and predict whole sequence at once.")
+    parser.add_argument("--vocabulary", dest="vocabulary", required=False,
+                        help="Canonical Pfam vocabulary JSON file the model was trained with.", metavar="FILE")
     parser.add_argument(dest='samples', nargs='+',
                         help="Paths to samples to predict.", metavar="SAMPLES")
     options = parser.parse_args()
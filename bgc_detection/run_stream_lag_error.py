@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Quantify error of fixed-lag streaming HMM predictions against the full-sequence predictions
+# Each contig of the Domain CSV files is streamed in chunks of domains, for each lag the absolute difference
+# to the full forward-backward prediction of the same domains is summarized
+
+try:
+    from utils import io
+    from pipeline import PipelineWrapper
+except ModuleNotFoundError:
+    from bgc_detection.utils import io
+    from bgc_detection.pipeline import PipelineWrapper
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def iterate_chunks(X, chunk_size):
+    for start in range(0, len(X), chunk_size):
+        yield X.iloc[start:start + chunk_size]
+
+
+def get_stream_lag_error(model, X_list, lags, chunk_size=100):
+    """
+    Compare fixed-lag streaming predictions with full-sequence predictions
+    :param model: Trained DiscreteHMM, GeneBorderHMM or ClusterFinderHMM
+    :param X_list: List of Domain DataFrames, each streamed separately
+    :param lags: List of lags to evaluate
+    :param chunk_size: Number of domains in each streamed chunk
+    :return: DataFrame with mean, 99th percentile and maximum absolute error for each lag
+    """
+    full = np.concatenate(model.predict_list(X_list))
+    results = []
+    for lag in lags:
+        streamed = np.concatenate([np.concatenate(list(model.predict_stream(iterate_chunks(X, chunk_size), lag=lag))) for X in X_list])
+        error = np.abs(streamed - full)
+        results.append({
+            'lag': lag,
+            'mean_error': error.mean(),
+            'p99_error': np.percentile(error, 99),
+            'max_error': error.max(),
+            'num_changed_at_0.5': int(((streamed >= 0.5) != (full >= 0.5)).sum())
+        })
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m", "--model", dest="model", required=True,
+                        help="Path to trained HMM model pickle file.", metavar="FILE")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output CSV file with error of each lag.", metavar="FILE")
+    parser.add_argument("-e", "--maxevalue", dest="maxevalue", required=True, type=float,
+                        help="Maximum domain independent e-value.", metavar="FLOAT")
+    parser.add_argument("-l", "--lag", dest="lags", type=int, action='append',
+                        help="Lag in domains, or proteins for GeneBorderHMM (repeat for more values).", metavar="INT")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=100,
+                        help="Number of domains in each streamed chunk.", metavar="INT")
+    parser.add_argument("--vocabulary", dest="vocabulary", required=False,
+                        help="Canonical Pfam vocabulary JSON file the model was trained with.", metavar="FILE")
+    parser.add_argument(dest='samples', nargs='+',
+                        help="Paths to Domain CSV files.", metavar="SAMPLES")
+    options = parser.parse_args()
+
+    if not options.lags:
+        options.lags = [0, 5, 10, 20, 50, 100]
+
+    pipeline = PipelineWrapper.load(options.model)
+    samples = []
+    for path in options.samples:
+        domains = io.read_domains(path, options.maxevalue, vocabulary=options.vocabulary)
+        samples += io.domains_to_samples(domains, 'contig_id')
+    print('Streaming {} contigs with {} domains...'.format(len(samples), sum(len(sample) for sample in samples)))
+
+    results = get_stream_lag_error(pipeline.model, pipeline.transformer.transform(samples), options.lags, chunk_size=options.chunk_size)
+    results.to_csv(options.output, index=False)
+
+    print(results)
+    print('Saved lag errors to:', options.output)
@@ -4,10 +4,14 @@
 
 try:
     from utils import io
+    from utils.timing import TimingLog, get_timing_log_path
     from pipeline import PipelineWrapper
+    from models.rnn import get_worker_rank
 except ModuleNotFoundError:
     from bgc_detection.utils import io
+    from bgc_detection.utils.timing import TimingLog, get_timing_log_path
     from bgc_detection.pipeline import PipelineWrapper
+    from bgc_detection.models.rnn import get_worker_rank
 import argparse
 import time
 import re
@@ -23,11 +27,11 @@ def create_progress_log_path(log_dir, model_output_path):
     filename = "{}-{}".format(date, label)
     return os.path.join(log_dir, filename)
 
-def read_samples(sample_paths, evalue):
+def read_samples(sample_paths, evalue, vocabulary=None):
     all_samples = []
     all_y = []
     for sample_path in sample_paths or []:
-        domains = io.read_domains(sample_path, max_evalue=evalue)
+        domains = io.read_domains(sample_path, max_evalue=evalue, vocabulary=vocabulary)
         samples, y_list = io.domains_to_samples(domains, 'contig_id', 'in_cluster')
         print('Loaded {} samples and {} domains from {}'.format(len(samples), len(domains), sample_path))
         all_samples += samples
@@ -35,10 +39,12 @@ def read_samples(sample_paths, evalue):
     return all_samples, all_y
 
 
-def run_training(config, output_path, sample_paths, validation_sample_paths=None, evalue=None, progress_log_path=None, files=None, verbose=1):
+def run_training(config, output_path, sample_paths, validation_sample_paths=None, evalue=None, progress_log_path=None, files=None, verbose=1,
+                 warm_start_path=None, vocabulary_path=None, slim=False):
     """
     Train a and save a BGC detection model using a JSON model config and a set of positive and negative set of samples - Domain DataFrames.
-    :param config: Model config parsed from JSON
+    Time spent in each training stage, per-epoch throughput and peak memory usage are saved in a JSON log next to the model file.
+    :param config: Model config parsed from JSON. When warm starting, only its fit_params are used to override the fit params of the trained pipeline.
     :param output_path: Path where to save trained model pickle file
     :param sample_paths: List of paths to Domain CSV training files. Each Domain CSV can contain multiple sample sequences marked with the 'contig_id' column. Output is provided in 'in_cluster' column.
     :param validation_sample_paths: List of paths to validation samples.
@@ -46,18 +52,36 @@ def run_training(config, output_path, sample_paths, validation_sample_paths=None
     :param progress_log_path: Path to folder where to store logging files (e.g. TensorBoard).
     :param files: Dictionary of file paths to inject into the model config. For example "{myFolder}/dep.txt" can be replaced to "../my/value/dep.txt" using {"myFolder": "../my/value"} dictionary
     :param verbose: Verbosity
+    :param warm_start_path: Path to trained pipeline pickle file. Its fitted feature transformers are kept and training continues from its model weights.
+    :param vocabulary_path: Path to canonical Pfam vocabulary JSON, used to add the integer pfam_code column to the samples.
+    :param slim: Save a slim model pickle with compact feature tables (pruned to the vocabulary if vocabulary_path is provided).
     """
     if files:
+        if not config:
+            raise AttributeError('Config file variables can only be replaced in a model config, specify the config or remove the files.')
         pairs = files.items() if isinstance(files, dict) else files
         for key, path in pairs:
             config = replace_in_dict(config, "{"+key+"}", path)
 
-    pipeline = PipelineWrapper.from_config(config)
-
-    print('Reading train samples:')
-    train_samples, train_y = read_samples(sample_paths, evalue=evalue)
-    print('Reading validation samples:')
-    validation_samples, validation_y = read_samples(validation_sample_paths, evalue=evalue)
+    if warm_start_path:
+        print('Continuing training of model:', warm_start_path)
+        pipeline = PipelineWrapper.load(warm_start_path)
+        if config:
+            pipeline.fit_params.update(config.get('fit_params', {}))
+        print('Fit params:', pipeline.fit_params)
+    else:
+        pipeline = PipelineWrapper.from_config(config)
+    timing = TimingLog(type=type(pipeline.model).__name__, label=pipeline.label, warm_start=warm_start_path)
+
+    with timing.section('read_samples'):
+        print('Reading train samples:')
+        train_samples, train_y = read_samples(sample_paths, evalue=evalue, vocabulary=vocabulary_path)
+        print('Reading validation samples:')
+        validation_samples, validation_y = read_samples(validation_sample_paths, evalue=evalue, vocabulary=vocabulary_path)
+
+    timing.info['num_samples'] = len(train_samples)
+    timing.info['num_domains'] = sum(len(sample) for sample in train_samples)
+    timing.info['num_validation_samples'] = len(validation_samples)
 
     print('Progress will be saved to:', progress_log_path)
     pipeline.fit(
@@ -66,14 +90,25 @@ def run_training(config, output_path, sample_paths, validation_sample_paths=None
         debug_progress_path=progress_log_path,
         validation_samples=validation_samples,
         validation_y=validation_y,
+        timing=timing,
+        warm_start=bool(warm_start_path),
         verbose=verbose
     )
 
-    pipeline.save(output_path)
+    if get_worker_rank() != 0:
+        # In distributed training, the model is saved only by the first worker
+        return
+
+    with timing.section('save'):
+        pipeline.save(output_path, slim=slim, vocabulary=vocabulary_path if slim else None)
+
+    timing_path = get_timing_log_path(output_path)
+    timing.save(timing_path)
 
     print('-'*80)
     print('Trained model saved to:', output_path)
     print('Progress saved to:', progress_log_path)
+    print('Timing log saved to:', timing_path)
     print('-'*80)
 
 def replace_in_dict(d, key, value):
@@ -88,8 +123,8 @@ def replace_in_dict(d, key, value):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("-c", "--config", dest="config", required=True,
-                        help="Path to JSON model config file.", metavar="FILE")
+    parser.add_argument("-c", "--config", dest="config", required=False,
+                        help="Path to JSON model config file. When used with --warm-start, only its fit_params are used.", metavar="FILE")
     parser.add_argument("-o", "--output", dest="output", required=True,
                         help="Where to write trained model file.", metavar="FILE")
     parser.add_argument("-e", "--evalue", dest="evalue", required=True, type=float,
@@ -102,14 +137,28 @@ if __name__ == '__main__':
                         help="Path to progress log directory (e.g. Tensorboard).", metavar="FILE")
     parser.add_argument("--log-file", dest="log_file", required=False,
                         help="Path to specific progress log file (e.g. Tensorboard).", metavar="FILE")
+    parser.add_argument("--warm-start", dest="warm_start", required=False,
+                        help="Continue training of given trained model pickle file, keeping its fitted feature transformers.", metavar="FILE")
+    parser.add_argument("--vocabulary", dest="vocabulary", required=False,
+                        help="Canonical Pfam vocabulary JSON file, should match the vocabulary in the model config.", metavar="FILE")
+    parser.add_argument("--slim", dest="slim", action='store_true',
+                        help="Save a slim model with compact feature tables, pruned to the --vocabulary if provided.")
     parser.add_argument("--verbose", dest="verbose", required=False, default=2, type=int,
                         help="Verbosity level (0=none, 1=progress bar, 2=once per epoch).", metavar="INT")
     parser.add_argument(dest='samples', nargs='*',
                         help="Paths to training samples.", metavar="SAMPLES")
     options = parser.parse_args()
 
-    with open(options.config, 'r') as fp:
-        config = json.load(fp)
+    if not options.config and not options.warm_start:
+        raise AttributeError('Specify model config using --config or trained model using --warm-start.')
+
+    if options.file and not options.config:
+        raise AttributeError('Config file variables (--file) can only be used with a model config (--config).')
+
+    config = None
+    if options.config:
+        with open(options.config, 'r') as fp:
+            config = json.load(fp)
 
     progress_log_path = options.log_file or create_progress_log_path(options.log_dir, options.output)
 
@@ -121,5 +170,8 @@ if __name__ == '__main__':
         evalue=options.evalue,
         progress_log_path=progress_log_path,
         files=options.file,
-        verbose=options.verbose
+        verbose=options.verbose,
+        warm_start_path=options.warm_start,
+        vocabulary_path=options.vocabulary,
+        slim=options.slim
     )
\ No newline at end of file
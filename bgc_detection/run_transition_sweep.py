@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Evaluate a grid of starting and transition probabilities of a trained HMM model on labelled Domain CSV files
+# Emission probabilities are looked up only once, each setting is scored by ROC AUC of the domain predictions
+# Values that are not swept are taken from the trained model
+
+try:
+    from pipeline import PipelineWrapper
+    from run_training import read_samples
+    from models.hmm_sweep import TransitionSweep, get_transition_grid
+except ModuleNotFoundError:
+    from bgc_detection.pipeline import PipelineWrapper
+    from bgc_detection.run_training import read_samples
+    from bgc_detection.models.hmm_sweep import TransitionSweep, get_transition_grid
+import argparse
+import multiprocessing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m", "--model", dest="model", required=True,
+                        help="Path to trained HMM model pickle file.", metavar="FILE")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output CSV file with ROC AUC of each setting.", metavar="FILE")
+    parser.add_argument("-e", "--evalue", dest="evalue", required=True, type=float,
+                        help="Maximum domain independent e-value.", metavar="FLOAT")
+    parser.add_argument("--start-bgc", dest="start_bgc", type=float, action='append',
+                        help="BGC starting probability (repeat for more values).", metavar="FLOAT")
+    parser.add_argument("--out2bgc", dest="out2bgc", type=float, action='append',
+                        help="Non-BGC to BGC transition probability (repeat for more values).", metavar="FLOAT")
+    parser.add_argument("--bgc2out", dest="bgc2out", type=float, action='append',
+                        help="BGC to non-BGC transition probability (repeat for more values).", metavar="FLOAT")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of processes (default: number of CPUs).", metavar="INT")
+    parser.add_argument("--vocabulary", dest="vocabulary", required=False,
+                        help="Canonical Pfam vocabulary JSON file the model was trained with.", metavar="FILE")
+    parser.add_argument(dest='samples', nargs='+',
+                        help="Paths to labelled Domain CSV files (with in_cluster column).", metavar="SAMPLES")
+    options = parser.parse_args()
+
+    pipeline = PipelineWrapper.load(options.model)
+    if not (options.start_bgc and options.out2bgc and options.bgc2out):
+        # Values that are not swept are taken from the trained model
+        try:
+            startprob, transmat = pipeline.model.get_two_state_params()
+        except AttributeError as e:
+            parser.error('Cannot get starting and transition probability of the model ({}), '
+                         'specify all of --start-bgc, --out2bgc and --bgc2out'.format(e))
+    if not options.start_bgc:
+        options.start_bgc = [startprob[1]]
+    if not options.out2bgc:
+        options.out2bgc = [transmat[0][1]]
+    if not options.bgc2out:
+        options.bgc2out = [transmat[1][0]]
+
+    samples, y_list = read_samples(options.samples, evalue=options.evalue, vocabulary=options.vocabulary)
+    sweep = TransitionSweep(pipeline.model, pipeline.transformer.transform(samples), y_list)
+
+    grid = get_transition_grid(options.start_bgc, options.out2bgc, options.bgc2out)
+    print('Evaluating {} settings on {} samples using {} processes...'.format(len(grid), len(samples), options.jobs))
+    results = sweep.evaluate_grid(grid, n_jobs=options.jobs)
+    results.to_csv(options.output, index=False)
+
+    print(results.head())
+    print('Saved sweep results to:', options.output)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Detect BGC candidates in Domain CSV files directly using a trained HMM model (DiscreteHMM, GeneBorderHMM or ClusterFinderHMM)
+# BGC states are decoded using the Viterbi algorithm (or thresholded posterior probability) and runs of BGC proteins
+# are saved as a BGC candidate CSV file, with the same columns as produced by candidates/threshold_candidates.py
+
+try:
+    from utils import io
+    from pipeline import PipelineWrapper
+    from candidates.state_candidates import get_state_candidates
+except ModuleNotFoundError:
+    from bgc_detection.utils import io
+    from bgc_detection.pipeline import PipelineWrapper
+    from bgc_detection.candidates.state_candidates import get_state_candidates
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def decode_candidates(pipeline, domains, method='viterbi', threshold=0.5, **candidate_params):
+    """
+    Get BGC candidates of all contigs in a Domain DataFrame
+    :param pipeline: Trained HMM pipeline
+    :param domains: Domain DataFrame, contigs marked by the 'contig_id' column
+    :param method: 'viterbi' or 'posterior', see HMM.decode_list
+    :param threshold: BGC prediction score threshold used with the 'posterior' method
+    :param candidate_params: Candidate merging and filtering params, see get_state_candidates
+    :return: DataFrame of BGC candidates. With the 'viterbi' method, a protein is a BGC protein if any of its domains is in the BGC state.
+    With the 'posterior' method, a protein is a BGC protein if its averaged prediction satisfies the threshold (as in threshold_candidates).
+    """
+    if method == 'posterior':
+        candidate_params['threshold'] = threshold
+    samples = io.domains_to_samples(domains, 'contig_id')
+    if not hasattr(pipeline.model, 'decode_list'):
+        raise AttributeError('Model {} does not support decoding'.format(type(pipeline.model).__name__))
+    states, predictions = pipeline.model.decode_list(pipeline.transformer.transform(samples), method=method, threshold=threshold)
+    if not samples:
+        return get_state_candidates(domains, [], [], **candidate_params)
+    return get_state_candidates(pd.concat(samples), np.concatenate(states), np.concatenate(predictions), **candidate_params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m", "--model", dest="model", required=True,
+                        help="Path to trained HMM model pickle file.", metavar="FILE")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output candidate CSV file path.", metavar="FILE")
+    parser.add_argument("-e", "--maxevalue", dest="maxevalue", required=True, type=float,
+                        help="Maximum domain independent e-value.", metavar="FLOAT")
+    parser.add_argument("--method", dest="method", default='viterbi', choices=['viterbi', 'posterior'],
+                        help="Decode the most likely state sequence (viterbi) or threshold the posterior probability averaged by protein (posterior).")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, default=0.5,
+                        help="Averaged protein prediction threshold used with the posterior method.", metavar="FLOAT")
+    parser.add_argument("-gg", "--gene-gap", dest="genegap", required=False, default=0, type=int,
+                        help="Merge candidates with gene-gap or less genes in between.", metavar="INT")
+    parser.add_argument("-ng", "--nucl-gap", dest="nuclgap", required=False, default=0, type=int,
+                        help="Merge candidates with nucl-gap or less nucleotides in between.", metavar="INT")
+    parser.add_argument("-md", "--min-bio-domains", dest="min_bio_domains", required=False, default=0, type=int,
+                        help="Include only candidate with at least given number of known biosynthetic protein domains.", metavar="INT")
+    parser.add_argument("-mp", "--min-proteins", dest="min_proteins", required=False, default=0, type=int,
+                        help="Include only candidate with at least given number of proteins.", metavar="INT")
+    parser.add_argument("-mn", "--min-nucleotides", dest="min_nucleotides", required=False, default=0, type=int,
+                        help="Include only candidate with at least given number of nucleotides.", metavar="INT")
+    parser.add_argument("--vocabulary", dest="vocabulary", required=False,
+                        help="Canonical Pfam vocabulary JSON file the model was trained with.", metavar="FILE")
+    parser.add_argument(dest='samples', nargs='+',
+                        help="Paths to Domain CSV files.", metavar="SAMPLES")
+    options = parser.parse_args()
+
+    pipeline = PipelineWrapper.load(options.model)
+
+    candidates = []
+    for path in options.samples:
+        domains = io.read_domains(path, options.maxevalue, vocabulary=options.vocabulary)
+        cands = decode_candidates(
+            pipeline,
+            domains,
+            method=options.method,
+            threshold=options.threshold,
+            max_protein_gap=options.genegap,
+            max_nucl_gap=options.nuclgap,
+            min_bio_domains=options.min_bio_domains,
+            min_proteins=options.min_proteins,
+            min_nucleotides=options.min_nucleotides
+        )
+        print('Found {} candidates in {}'.format(len(cands), path))
+        candidates.append(cands)
+
+    candidates: pd.DataFrame = pd.concat(candidates)
+    candidates.to_csv(options.output, index=False)
+
+    print('Saved {} candidates to {}'.format(len(candidates), options.output))
@@ -3,6 +3,7 @@
 # Calculate Levenshtein Pfam ID similarity for given Domain CSV files
 # Each Pfam ID is considered a unique symbol (character)
 # Will produce a symmetrical matrix
+# To use a canonical Pfam vocabulary, run from the bgc_detection folder as: python -m similarity.sequence_similarity_matrix --vocabulary ...
 
 import argparse
 import pandas as pd
@@ -23,27 +24,48 @@ def sequence_similarity_task(args):
         similarity[i] = get_sequence_similarity(string, other_string)
     return similarity
 
-def get_string_from_word_list(word_list, word_index):
-    return ''.join([chr(word_index[w]+200) for w in word_list])
+def get_string_from_codes(codes):
+    return ''.join(map(chr, codes + 200))
 
-def get_word_index(words):
-    return {word: i for i, word in enumerate(set(words))}
-
-def get_sequences_as_strings(domains, word_index):
-    return domains.groupby('contig_id')['pfam_id'].apply(lambda pfam_ids: get_string_from_word_list(pfam_ids, word_index))
-
-def sequence_similarity_matrix(a_domains, b_domains=None):
+def get_word_codes(words, vocabulary=None, known_codes=None):
+    """
+    Turn words into integer codes
+    :param words: Array of words (pfam IDs)
+    :param vocabulary: Optional canonical PfamVocabulary, its codes are used for known words.
+    Words not present in the vocabulary are given codes that follow after the vocabulary.
+    :param known_codes: Vocabulary codes of the words (-1 for unknown words), e.g. from vocabulary.get_codes. Encoded from words if not provided.
+    :return: numpy array of integer codes
+    """
+    if vocabulary is None:
+        unique_words, codes = np.unique(words, return_inverse=True)
+        return codes
+    codes = np.array(vocabulary.encode(words) if known_codes is None else known_codes, dtype=np.int64)
+    unknown = codes == -1
+    unknown_words, unknown_codes = np.unique(words[unknown], return_inverse=True)
+    codes[unknown] = len(vocabulary) + unknown_codes
+    return codes
+
+def get_sequences_as_strings(domains, codes):
+    codes = pd.Series(codes, index=domains.index)
+    return codes.groupby(domains['contig_id']).apply(lambda contig_codes: get_string_from_codes(contig_codes.values))
+
+def sequence_similarity_matrix(a_domains, b_domains=None, vocabulary=None):
     """
     Get sequence similarity for all pairs of samples from a_domains and b_domains
     :param a_domains: Domain DataFrame with pfam_id and contig_id of samples
     :param b_domains: Domain DataFrame with pfam_id and contig_id of samples to compare with (can be equal to a_samples)
+    :param vocabulary: Optional canonical PfamVocabulary, the pfam_code column is used if it was encoded using this vocabulary (see io.read_domains)
     :return: Similarity matrix indexed by samples in a_domains and columns by b_domains.
     """
     if b_domains is None:
         b_domains = a_domains
-    word_index = get_word_index(np.concatenate([a_domains['pfam_id'], b_domains['pfam_id']]))
-    a_strings = get_sequences_as_strings(a_domains, word_index)
-    b_strings = get_sequences_as_strings(b_domains, word_index)
+    words = np.concatenate([a_domains['pfam_id'].values, b_domains['pfam_id'].values]).astype(str)
+    known_codes = None
+    if vocabulary is not None:
+        known_codes = np.concatenate([vocabulary.get_codes(a_domains), vocabulary.get_codes(b_domains)])
+    codes = get_word_codes(words, vocabulary, known_codes=known_codes)
+    a_strings = get_sequences_as_strings(a_domains, codes[:len(a_domains)])
+    b_strings = get_sequences_as_strings(b_domains, codes[len(a_domains):])
 
     print('Computing {:,} * {:,} similarities'.format(len(a_strings), len(b_strings)))
 
@@ -61,6 +83,8 @@ if __name__ == "__main__":
                         help="Sequences to compare against (leave blank for self-comparison).", metavar="FILE")
     parser.add_argument("-o", "--output", dest="output", required=True,
                         help="Output file path.", metavar="FILE")
+    parser.add_argument("--vocabulary", dest="vocabulary", required=False,
+                        help="Canonical Pfam vocabulary JSON file.", metavar="FILE")
     parser.add_argument(dest='domains', nargs='+',
                         help="Domain CSV files.", metavar="FILE")
 
@@ -69,7 +93,15 @@ if __name__ == "__main__":
     domains: pd.DataFrame = pd.concat([pd.read_csv(path)[['contig_id', 'pfam_id']] for path in options.domains])
     to_compare = pd.read_csv(options.compare)[['contig_id', 'pfam_id']] if options.compare else None
 
-    matrix = sequence_similarity_matrix(domains, to_compare)
+    vocabulary = None
+    if options.vocabulary:
+        try:
+            from utils.vocabulary import PfamVocabulary
+        except ImportError:
+            from bgc_detection.utils.vocabulary import PfamVocabulary
+        vocabulary = PfamVocabulary.load(options.vocabulary)
+
+    matrix = sequence_similarity_matrix(domains, to_compare, vocabulary=vocabulary)
 
     matrix.to_csv(options.output, index=True)
     print('Saved {}x{} similarity matrix to: {}'.format(matrix.shape[0], matrix.shape[1], options.output))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Reading pfam2vec embeddings and the compiled memory-mapped pfam2vec format
+# Compiled embedding is a float32 .npy matrix with a vocabulary JSON file (see vocabulary.py) stored next to it,
+# it can be memory-mapped so that all processes on a node share one page-cached copy of the vectors
+# Run as a script to compile a word2vec .bin file or a pfam2vec CSV file
+
+import argparse
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+try:
+    from .vocabulary import PfamVocabulary
+except ImportError:
+    from vocabulary import PfamVocabulary
+
+_loaded_embeddings = {}
+
+
+def read_pfam2vec(vector_path):
+    """
+    Read pfam2vec vectors from a word2vec binary file, a CSV file with pfam_id column or a compiled .npy file
+    :param vector_path: Path to word2vec .bin file, .csv file or compiled .npy file
+    :return: DataFrame of vectors indexed by pfam_id
+    """
+    if is_compiled_pfam2vec(vector_path):
+        pfam_ids, matrix = load_compiled_pfam2vec(vector_path)
+        return pd.DataFrame(np.array(matrix), index=pd.Index(pfam_ids, name='pfam_id'))
+    if vector_path.endswith('.csv'):
+        return pd.read_csv(vector_path).set_index('pfam_id')
+    import word2vec
+    model = word2vec.load(vector_path, kind='bin')
+    return pd.DataFrame(model.vectors, index=model.vocab)
+
+
+def is_compiled_pfam2vec(vector_path):
+    return vector_path.endswith('.npy')
+
+
+def get_compiled_vocabulary_path(vector_path):
+    """
+    Get path of the vocabulary JSON file of a compiled pfam2vec .npy file
+    """
+    return os.path.splitext(vector_path)[0] + '.vocab.json'
+
+
+def compile_pfam2vec(vectors, output_path, version=None):
+    """
+    Save pfam2vec vectors in the compiled format
+    :param vectors: DataFrame of vectors indexed by pfam_id
+    :param output_path: Path of the output .npy file, vocabulary is saved next to it
+    :param version: Version stored in the vocabulary file (e.g. name of the source file)
+    :return: Checksum of the compiled embedding
+    """
+    if not is_compiled_pfam2vec(output_path):
+        raise ValueError('Compiled pfam2vec path has to end with .npy, got {}'.format(output_path))
+    np.save(output_path, np.ascontiguousarray(vectors.values, dtype=np.float32))
+    PfamVocabulary(vectors.index.astype(str), version=version).save(get_compiled_vocabulary_path(output_path))
+    return get_compiled_checksum(output_path)
+
+
+def get_compiled_checksum(vector_path):
+    """
+    MD5 checksum of a compiled pfam2vec file and its vocabulary
+    """
+    md5 = hashlib.md5()
+    with open(vector_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    with open(get_compiled_vocabulary_path(vector_path), 'rb') as f:
+        md5.update(f.read())
+    return md5.hexdigest()
+
+
+def load_compiled_pfam2vec(vector_path, checksum=None):
+    """
+    Memory-map a compiled pfam2vec file, loaded files are cached so that they are mapped only once in each process
+    :param vector_path: Path to compiled .npy file
+    :param checksum: Expected checksum of the file (see get_compiled_checksum), check is skipped if not provided
+    :return: Tuple of (numpy array of pfam IDs, read-only memory-mapped float32 matrix with a row for each pfam ID)
+    """
+    path = os.path.abspath(vector_path)
+    if path not in _loaded_embeddings:
+        vocabulary = PfamVocabulary.load(get_compiled_vocabulary_path(path))
+        matrix = np.load(path, mmap_mode='r')
+        if matrix.shape[0] != len(vocabulary):
+            raise ValueError('Compiled pfam2vec {} has {} vectors but {} pfam IDs'.format(path, matrix.shape[0], len(vocabulary)))
+        _loaded_embeddings[path] = (vocabulary.pfam_ids, matrix, get_compiled_checksum(path))
+    pfam_ids, matrix, loaded_checksum = _loaded_embeddings[path]
+    if checksum is not None and checksum != loaded_checksum:
+        raise ValueError('Compiled pfam2vec {} does not match the checksum stored in the model, '
+                         'expected {} got {}'.format(path, checksum, loaded_checksum))
+    return pfam_ids, matrix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", dest="input", required=True,
+                        help="Input pfam2vec word2vec .bin file or CSV file with pfam_id column.", metavar="FILE")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output compiled .npy file path (vocabulary is saved to .vocab.json next to it).", metavar="FILE")
+    options = parser.parse_args()
+
+    vectors = read_pfam2vec(options.input)
+    checksum = compile_pfam2vec(vectors, options.output, version=os.path.basename(options.input))
+    print('Saved {}x{} pfam2vec matrix to {} (checksum {})'.format(vectors.shape[0], vectors.shape[1], options.output, checksum))
@@ -3,18 +3,38 @@
 # Feature transformers that turn Domain DataFrames into protein feature vector matrices
 
 import numpy as np
+import scipy.sparse
 from sklearn.base import BaseEstimator, TransformerMixin
 import pandas as pd
-import word2vec
 import sys
+import copy
+import hashlib
+import mmap
+import multiprocessing
+from .vocabulary import get_vocabulary, PfamLookup, take_rows
+from .embedding import read_pfam2vec, is_compiled_pfam2vec, load_compiled_pfam2vec, get_compiled_checksum
 
 
 class ListTransformer(BaseEstimator, TransformerMixin):
     """
     Wrapper for other transformers, will transform each DataFrame in a list by each transformer and merge the results.
+
+    Lists of DataFrames are transformed in a batch: all samples are merged together, each transformer is run once
+    and the result is split back into a matrix for each sample. Transformers whose output for one domain
+    depends on the neighbouring domains (that don't set rowwise = True) are still run separately on each sample.
+    When any of the transformers produces a scipy sparse matrix, the blocks are merged into a sparse CSR matrix.
+
+    With n_jobs, lists of DataFrames are split into shards with approximately the same number of domains
+    which are transformed in forked worker processes. Each worker writes its rows directly into a shared memory
+    output matrix, so the feature matrices are not copied back to the main process.
     """
-    def __init__(self, transformers):
+    def __init__(self, transformers, n_jobs=1):
+        """
+        :param transformers: List of transformers
+        :param n_jobs: Number of worker processes used to transform lists of DataFrames (-1 = number of CPUs)
+        """
         self.transformers = transformers
+        self.n_jobs = n_jobs
 
     def transform(self, X, y=None):
         if X is None:
@@ -22,10 +42,75 @@ class ListTransformer(BaseEstimator, TransformerMixin):
         if not self.transformers:
             return X
         if isinstance(X, list):
-            return [self.transform(X[i], y[i] if y else None) for i in range(0, len(X))]
+            return self._transform_list(X)
         if not isinstance(X, pd.DataFrame):
             raise AttributeError('X has to be a pd.DataFrame or list, got '+str(type(X)))
-        return np.concatenate([t.transform(X, y) for t in self.transformers], axis=1)
+        return _hstack_blocks([t.transform(X, y) for t in self.transformers])
+
+    def _transform_list(self, X_list):
+        """
+        Transform list of DataFrames by running each transformer once on all DataFrames merged together
+        :param X_list: List of Domain DataFrames
+        :return: List of feature matrices, one for each DataFrame
+        """
+        if not X_list:
+            return []
+        for X in X_list:
+            if not isinstance(X, pd.DataFrame):
+                raise AttributeError('X has to be a pd.DataFrame or list, got '+str(type(X)))
+        num_jobs = _get_num_jobs(getattr(self, 'n_jobs', 1), len(X_list))
+        matrix = None
+        if num_jobs > 1:
+            matrix = self._transform_merged_parallel(X_list, num_jobs)
+        if matrix is None:
+            matrix = self._transform_merged(X_list)
+        offsets = np.cumsum([len(X) for X in X_list])[:-1]
+        if scipy.sparse.issparse(matrix):
+            starts = np.concatenate([[0], offsets])
+            ends = np.concatenate([offsets, [matrix.shape[0]]])
+            return [matrix[start:end] for start, end in zip(starts, ends)]
+        # Split into views of the merged matrix
+        return np.split(matrix, offsets)
+
+    def _transform_merged(self, X_list):
+        """
+        Transform list of DataFrames into one feature matrix with rows of all DataFrames
+        """
+        merged = pd.concat(X_list, ignore_index=True)
+        blocks = []
+        for t in self.transformers:
+            if getattr(t, 'rowwise', False):
+                blocks.append(t.transform(merged))
+            else:
+                blocks.append(_vstack_blocks([t.transform(X) for X in X_list]))
+        return _hstack_blocks(blocks)
+
+    def _transform_merged_parallel(self, X_list, num_jobs):
+        """
+        Transform list of DataFrames into one feature matrix using forked worker processes.
+        Workers write into a shared memory matrix, samples and transformers are inherited by the workers without pickling.
+        :return: Feature matrix with rows of all DataFrames, or None if the features are sparse
+        """
+        global _parallel_transform_state
+        # Output width and type are taken from the features of the first sample
+        first = self._transform_merged(X_list[:1])
+        if scipy.sparse.issparse(first):
+            return None
+        lengths = np.array([len(X) for X in X_list])
+        row_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # Shards of consecutive samples with approximately the same number of domains
+        bounds = np.searchsorted(row_offsets, np.linspace(0, row_offsets[-1], num_jobs + 1)[1:-1])
+        bounds = np.unique(np.concatenate([[0], bounds, [len(X_list)]]))
+        shape = (row_offsets[-1], first.shape[1])
+        output = _create_shared_matrix(shape, first.dtype)
+        _parallel_transform_state = (self, X_list, output)
+        try:
+            with multiprocessing.get_context('fork').Pool(len(bounds) - 1) as pool:
+                tasks = [(start, end, row_offsets[start], row_offsets[end]) for start, end in zip(bounds[:-1], bounds[1:])]
+                pool.map(_transform_shard_task, tasks)
+        finally:
+            _parallel_transform_state = None
+        return output
 
     def fit(self, X_list, y_list=None):
         if X_list is None:
@@ -33,91 +118,326 @@ class ListTransformer(BaseEstimator, TransformerMixin):
         if not isinstance(X_list, list):
             raise AttributeError('X_list has to be a list, got'+str(type(X_list)))
         if X_list:
+            X = pd.concat(X_list, ignore_index=True)
+            y = np.concatenate(y_list) if y_list is not None else None
+            for t in self.transformers:
+                t.fit(X, y)
+        return self
+
+    def partial_fit(self, X_list, y_list=None):
+        """
+        Update the fitted transformers with a chunk of samples. Can be called repeatedly
+        to fit the transformers on a corpus that does not fit into memory, for example:
+
+            for path in paths:
+                samples, y_list = io.domains_to_samples(io.read_domains(path), 'contig_id', 'in_cluster')
+                transformer.partial_fit(samples, y_list)
+
+        Transformers that do not implement partial_fit (e.g. Pfam2VecTransformer) do not need to be fitted.
+        :param X_list: List of Domain DataFrames
+        :param y_list: List of outputs of each DataFrame
+        :return: self
+        """
+        if not isinstance(X_list, list):
+            raise AttributeError('X_list has to be a list, got'+str(type(X_list)))
+        if X_list:
+            X = pd.concat(X_list, ignore_index=True)
+            y = np.concatenate(y_list) if y_list is not None else None
             for t in self.transformers:
-                t.fit(pd.concat(X_list), pd.concat(y_list))
+                if hasattr(t, 'partial_fit'):
+                    t.partial_fit(X, y)
         return self
 
+    def slim(self, pfam_ids=None):
+        """
+        Get copy with slim transformers that store their tables as compact numpy arrays, see PfamTableTransformer.slim
+        Equal arrays (e.g. pfam IDs of transformers using the same pfam2vec file) are shared, so that they are pickled only once.
+        :param pfam_ids: Keep only table rows of given pfam IDs, other pfam IDs will be treated as unknown
+        :return: Slim copy of the ListTransformer
+        """
+        shared_arrays = {}
+        slim = copy.copy(self)
+        slim.transformers = [t.slim(pfam_ids, shared_arrays) if hasattr(t, 'slim') else t for t in self.transformers]
+        return slim
+
     @classmethod
-    def from_config(cls, transformer_configs):
+    def from_config(cls, transformer_configs, n_jobs=1):
         transformers = []
         for params in transformer_configs:
             classname = params.get('type')
             transformer = getattr(sys.modules[__name__], classname)
             trans_args = {k: v for k, v in params.items() if k != 'type'}
             transformers.append(transformer(**trans_args))
-        return ListTransformer(transformers)
+        return ListTransformer(transformers, n_jobs=n_jobs)
 
 
-class Pfam2VecTransformer(BaseEstimator, TransformerMixin):
+# ListTransformer, samples and output matrix of the running parallel transformation, inherited by forked workers
+_parallel_transform_state = None
+
+
+def _transform_shard_task(args):
+    start, end, row_start, row_end = args
+    transformer, X_list, output = _parallel_transform_state
+    output[row_start:row_end] = transformer._transform_merged(X_list[start:end])
+
+
+def _create_shared_matrix(shape, dtype):
+    """
+    Create numpy matrix in anonymous shared memory that is shared with forked processes
+    """
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    buffer = mmap.mmap(-1, nbytes)
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _share_array(array, shared_arrays):
+    """
+    Get previously seen array equal to given array, so that equal arrays are stored only once
+    """
+    if shared_arrays is None:
+        return array
+    key = (array.dtype.str, array.shape, hashlib.md5(array.tobytes()).hexdigest())
+    return shared_arrays.setdefault(key, array)
+
+
+def _get_num_jobs(n_jobs, num_samples):
+    """
+    Get number of worker processes to use, parallel transformation needs the fork start method and cannot be
+    started from a daemon process (e.g. a worker of a multiprocessing Pool)
+    """
+    if n_jobs is None or n_jobs == 1 or num_samples < 2:
+        return 1
+    if 'fork' not in multiprocessing.get_all_start_methods() or multiprocessing.current_process().daemon:
+        return 1
+    if n_jobs < 0:
+        n_jobs = multiprocessing.cpu_count() + 1 + n_jobs
+    return max(min(n_jobs, num_samples), 1)
+
+
+def _hstack_blocks(blocks):
+    """
+    Merge feature blocks column-wise, produces a sparse CSR matrix if any of the blocks is sparse
+    """
+    if any(scipy.sparse.issparse(block) for block in blocks):
+        return scipy.sparse.hstack([block if scipy.sparse.issparse(block) else scipy.sparse.csr_matrix(np.asarray(block)) for block in blocks], format='csr')
+    return np.concatenate([np.asarray(block) for block in blocks], axis=1)
+
+
+def _vstack_blocks(blocks):
+    """
+    Merge feature blocks row-wise, keeps sparse blocks sparse
+    """
+    if any(scipy.sparse.issparse(block) for block in blocks):
+        return scipy.sparse.vstack(blocks, format='csr')
+    return np.concatenate([np.asarray(block) for block in blocks])
+
+
+class PfamTableTransformer(BaseEstimator, TransformerMixin):
+    """
+    Parent class of transformers that turn each pfam_id into a row of a (fitted) table of vectors.
+    Pfam IDs are turned into integer row numbers (using the integer 'pfam_code' column if a canonical vocabulary is provided),
+    unknown pfam IDs get a zero vector.
+    """
+    rowwise = True
+    # Whether rows of the table can be removed without changing the output for other pfam IDs
+    prunable = True
+    # Attributes with the fitted table, replaced by compact arrays in slim transformers
+    table_attributes = ()
+
+    def _get_table(self):
+        """
+        Get table of vectors, implemented by each transformer
+        :return: Tuple of (list of pfam IDs, numpy matrix with a row for each pfam ID)
+        """
+        raise NotImplementedError()
+
+    def _get_lookup(self):
+        """
+        Get cached PfamLookup and table of vectors
+        :return: Tuple of (PfamLookup, numpy matrix)
+        """
+        cached = getattr(self, '_lookup', None)
+        if cached is None:
+            pfam_ids, table = self._get_stored_table()
+            vocabulary = get_vocabulary(getattr(self, 'vocabulary', None))
+            cached = (PfamLookup(pfam_ids, vocabulary), None if table is None else np.asarray(table))
+            self._lookup = cached
+        return cached
+
+    def _get_stored_table(self):
+        """
+        Get table of vectors, either from the compact arrays of a slim transformer or from the fitted attributes
+        """
+        compact_pfam_ids = getattr(self, 'compact_pfam_ids', None)
+        if compact_pfam_ids is not None:
+            return compact_pfam_ids.astype(str), self.compact_table
+        return self._get_table()
+
+    def transform(self, X, y=None):
+        # Turn each pfam ID into a vector
+        lookup, table = self._get_lookup()
+        return take_rows(table, lookup.get_rows(X))
+
+    def slim(self, pfam_ids=None, shared_arrays=None):
+        """
+        Get copy of the transformer that stores its table as compact numpy arrays instead of DataFrames or dictionaries.
+        Rows with zero vectors are removed, since unknown pfam IDs get a zero vector anyway. Slim transformers cannot be fitted further.
+        :param pfam_ids: Keep only rows of given pfam IDs, other pfam IDs will be treated as unknown (only used if the table is prunable)
+        :param shared_arrays: Dictionary used to share equal arrays between transformers, so that they are pickled only once
+        :return: Slim copy of the transformer
+        """
+        table_ids, table = self._get_stored_table()
+        table_ids = np.asarray(table_ids).astype(str)
+        table = None if table is None else np.asarray(table)
+        if self.prunable:
+            keep = np.ones(len(table_ids), dtype=bool)
+            if pfam_ids is not None:
+                keep &= np.isin(table_ids, np.asarray(pfam_ids).astype(str))
+            if table is not None:
+                keep &= np.any(table != 0, axis=1)
+            table_ids = table_ids[keep]
+            table = None if table is None else table[keep]
+        slim = copy.copy(self)
+        slim.__dict__.pop('_lookup', None)
+        for attribute in self.table_attributes:
+            setattr(slim, attribute, None)
+        slim.compact_pfam_ids = _share_array(table_ids.astype(np.bytes_), shared_arrays)
+        slim.compact_table = None if table is None else _share_array(np.ascontiguousarray(table), shared_arrays)
+        return slim
+
+    def __getstate__(self):
+        # The lookup is created again when needed
+        state = self.__dict__.copy()
+        state.pop('_lookup', None)
+        return state
+
+
+class Pfam2VecTransformer(PfamTableTransformer):
     """
     Get pfam2vec matrix for a Domain DataFrame
+
+    When using a compiled pfam2vec .npy file (see utils/embedding.py), the vectors are memory-mapped
+    and only the path and checksum of the file are stored in the pickled transformer.
     """
-    def __init__(self, vector_path):
+    table_attributes = ('vectors',)
+
+    def __init__(self, vector_path, vocabulary=None):
         self.vector_path = vector_path
-        if vector_path.endswith('.csv'):
-            self.vectors = pd.read_csv(vector_path).set_index('pfam_id')
+        self.vocabulary = vocabulary
+        if is_compiled_pfam2vec(vector_path):
+            self.vectors = None
+            self.checksum = get_compiled_checksum(vector_path)
         else:
-            model = word2vec.load(vector_path, kind='bin')
-            self.vectors = pd.DataFrame(model.vectors, index=model.vocab)
+            self.vectors = read_pfam2vec(vector_path)
+
+    def _get_table(self):
+        if self.vectors is None:
+            return load_compiled_pfam2vec(self.vector_path, checksum=self.checksum)
+        return self.vectors.index, self.vectors.values
+
+    def slim(self, pfam_ids=None, shared_arrays=None):
+        if self.vectors is None and getattr(self, 'compact_pfam_ids', None) is None:
+            # Compiled vectors are already stored only as a reference
+            return self
+        return super(Pfam2VecTransformer, self).slim(pfam_ids, shared_arrays)
+
+    def fit(self, X, y=None):
+        return self
+
+
+class PfamCodeTransformer(PfamTableTransformer):
+    """
+    Get integer code of each pfam_id in the pfam2vec vocabulary, to be embedded inside the model (see KerasEmbeddingRNN).
+    Codes start from 1 (the row number in the pfam2vec file plus one), 0 is used for unknown pfam IDs and padding.
+    """
+    # Codes are positions in the pfam2vec file, so rows cannot be removed
+    prunable = False
+    table_attributes = ('pfam2vec_ids',)
+
+    def __init__(self, vector_path, vocabulary=None):
+        self.vector_path = vector_path
+        self.vocabulary = vocabulary
+        if is_compiled_pfam2vec(vector_path):
+            self.pfam2vec_ids, _ = load_compiled_pfam2vec(vector_path)
+        else:
+            self.pfam2vec_ids = read_pfam2vec(vector_path).index
+
+    def _get_table(self):
+        return self.pfam2vec_ids, None
 
     def transform(self, X, y=None):
-        # Turn each pfam ID into a vector
-        return self.vectors.reindex(index=X['pfam_id']).fillna(0)
+        lookup, _ = self._get_lookup()
+        return (lookup.get_rows(X) + 1).reshape(-1, 1)
 
     def fit(self, X, y=None):
         return self
 
 
-class RandomVecTransformer(BaseEstimator, TransformerMixin):
+class RandomVecTransformer(PfamTableTransformer):
     """
     Get random vector matrix for a Domain DataFrame. Each unique pfam_id will have the same random vector throughout the sequence.
     """
+    table_attributes = ('vectors',)
 
-    def __init__(self, dimensions=100):
+    def __init__(self, dimensions=100, vocabulary=None):
         self.dimensions = dimensions
+        self.vocabulary = vocabulary
         self.zero_vector = np.zeros(self.dimensions)
         self.vectors = {}
         self.random = np.random.RandomState(seed=0)
 
-    def transform(self, X, y=None):
-        # Turn each pfam ID into a vector
-        return np.array([self.vectors.get(pfam_id, self.zero_vector) for pfam_id in X['pfam_id']])
-        #print(X.iloc[0]['pfam_id'], vectors[0])
-        #return vectors
+    def _get_table(self):
+        return list(self.vectors.keys()), np.array(list(self.vectors.values())).reshape(-1, self.dimensions)
 
-    def fit(self, X, y=None):
-        for pfam_id in X['pfam_id'].unique():
-            if pfam_id not in self.vectors:
-                self.vectors[pfam_id] = self.random.rand(self.dimensions)
+    def partial_fit(self, X, y=None):
+        # Generate vectors of new pfam IDs in order of their first appearance
+        new_pfam_ids = _get_new_pfam_ids(pd.Index(list(self.vectors.keys())), X['pfam_id'])
+        self.vectors.update(zip(new_pfam_ids, self.random.rand(len(new_pfam_ids), self.dimensions)))
+        self._lookup = None
         return self
 
+    def fit(self, X, y=None):
+        # Vectors of previously seen pfam IDs are kept
+        return self.partial_fit(X, y)
 
-class EmissionProbabilityTransformer(BaseEstimator, TransformerMixin):
+
+class EmissionProbabilityTransformer(PfamTableTransformer):
     """
     Get emission probability feature column for given Domain DataFrame. Based on HMM emissions.
     """
-    def __init__(self):
+    table_attributes = ('emissions', 'counts')
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary
         self.emissions = None
+        self.counts = None
+
+    def _get_table(self):
+        return self.emissions.index, self.emissions.values
+
+    def partial_fit(self, X, y):
+        """
+        Add number of occurences of each pfam ID in negative and positive state to the counts and update the emissions.
+        Can be called repeatedly on chunks of a corpus that does not fit into memory.
+        :param X: Domain DataFrame with pfam_id column
+        :param y: Series or array of states of each domain (0 = non-BGC, 1 = BGC)
+        :return: self
+        """
+        self.counts = _add_pfam_state_counts(self.counts, X['pfam_id'], y)
+        # Divide each state's emission counts by the total number of observations to get emission frequency
+        self.emissions = self.counts / self.counts.sum(axis=0)
+        self._lookup = None
+        return self
 
     def fit(self, X, y=None):
         unique_y = set(y)
         if unique_y != {0, 1}:
             raise AttributeError('Invalid target values, expected {0, 1} got ' + str(unique_y))
-        counts = pd.DataFrame(data={}, index=X['pfam_id'].unique())
-        counts['neg'] = X[y == 0]['pfam_id'].value_counts()
-        counts['pos'] = X[y == 1]['pfam_id'].value_counts()
-        counts = counts.fillna(0)
-        # Divide each state's emission counts by the total number of observations to get emission frequency
-        self.emissions = counts / counts.sum(axis=0)
-        return self
-
-    def transform(self, X, y=None):
-        # Turn each pfam ID into a vector
-        vectors = self.emissions.reindex(index=X['pfam_id'], fill_value=0)
-        return vectors
+        self.counts = None
+        return self.partial_fit(X, y)
 
 
-class PositiveProbabilityTransformer(BaseEstimator, TransformerMixin):
+class PositiveProbabilityTransformer(PfamTableTransformer):
     """
     Get "positive probability" feature columns for given Domain DataFrame.
     Each pfam_id will get two columns: Positive probability and Total probability
@@ -126,45 +446,117 @@ class PositiveProbabilityTransformer(BaseEstimator, TransformerMixin):
     Total probability = probability of seeing given pfam in general,
       which is equivalent to number of occurences divided by total length of input sequence
     """
-    def __init__(self):
-        self.probs = None
+    table_attributes = ('probs', 'counts')
 
-    def fit(self, X, y=None):
-        vals = pd.DataFrame({'pfam_id': X['pfam_id'], 'y': y})
-        negweight = sum(y) / sum(y == 0)
-        total_num_weighted = sum(y) + sum(y == 0) * negweight
-        probs = {}
-        for pfam_id, pfam_y in vals.groupby('pfam_id')['y']:
-            num_pos = sum(pfam_y)
-            num_neg = sum(pfam_y == 0)
-            num_weighted = num_pos + num_neg * negweight
-            prob = num_pos / num_weighted
-            prob = (prob - 0.5) * 2
-            pfam_frac = num_weighted / total_num_weighted
-            probs[pfam_id] = [prob, pfam_frac]
-        self.probs = pd.DataFrame(probs).transpose()
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary
+        self.probs = None
+        self.counts = None
+
+    def _get_table(self):
+        return self.probs.index, self.probs.values
+
+    def partial_fit(self, X, y):
+        """
+        Add number of occurences of each pfam ID in negative and positive state to the counts and update the probabilities.
+        Can be called repeatedly on chunks of a corpus that does not fit into memory.
+        :param X: Domain DataFrame with pfam_id column
+        :param y: Series or array of states of each domain (0 = non-BGC, 1 = BGC)
+        :return: self
+        """
+        self.counts = _add_pfam_state_counts(self.counts, X['pfam_id'], y)
+        num_neg = self.counts['neg'].values
+        num_pos = self.counts['pos'].values
+        negweight = num_pos.sum() / num_neg.sum()
+        total_num_weighted = num_pos.sum() + num_neg.sum() * negweight
+        num_weighted = num_pos + num_neg * negweight
+        prob = num_pos / num_weighted
+        prob = (prob - 0.5) * 2
+        pfam_frac = num_weighted / total_num_weighted
+        self.probs = pd.DataFrame({0: prob, 1: pfam_frac}, index=self.counts.index)
+        self._lookup = None
         return self
 
-    def transform(self, X, y=None):
-        # Turn each pfam ID into a vector
-        vectors = self.probs.reindex(index=X['pfam_id'], fill_value=0)
-        return vectors
+    def fit(self, X, y=None):
+        self.counts = None
+        return self.partial_fit(X, y)
 
 
-class OneHotEncodingTransformer(BaseEstimator, TransformerMixin):
+class OneHotEncodingTransformer(PfamTableTransformer):
     """
     Create a binary one-hot-encoding vector from Domain CSV files.
     """
-    def __init__(self):
+    # Each pfam ID has its own column, so rows cannot be removed
+    prunable = False
+    table_attributes = ('pfam_ids',)
+
+    def __init__(self, vocabulary=None, sparse=False):
+        """
+        :param vocabulary: Canonical PfamVocabulary or path to vocabulary JSON, used to look up the integer pfam_code column.
+        :param sparse: Produce a scipy sparse CSR matrix instead of a dense numpy matrix.
+        """
+        self.vocabulary = vocabulary
+        self.sparse = sparse
         self.pfam_ids = []
 
+    def _get_table(self):
+        return self.pfam_ids, None
+
     def transform(self, X, y=None):
         # Turn each pfam ID into a vector
-        return pd.get_dummies(X['pfam_id']).reindex(columns=self.pfam_ids, fill_value=0)
+        lookup, _ = self._get_lookup()
+        rows = lookup.get_rows(X)
+        known = rows >= 0
+        shape = (len(rows), len(lookup.index))
+        if getattr(self, 'sparse', False):
+            return scipy.sparse.csr_matrix((np.ones(known.sum(), dtype=np.uint8), (np.where(known)[0], rows[known])), shape=shape)
+        encoded = np.zeros(shape, dtype=np.uint8)
+        encoded[np.where(known)[0], rows[known]] = 1
+        return encoded
+
+    def partial_fit(self, X, y=None):
+        self.pfam_ids = np.union1d(self.pfam_ids, X['pfam_id'].unique())
+        self._lookup = None
+        return self
 
     def fit(self, X, y=None):
-        self.pfam_ids = np.union1d(self.pfam_ids, X['pfam_id'])
-        return self
+        # Previously seen pfam IDs are kept
+        return self.partial_fit(X, y)
+
+
+def _get_new_pfam_ids(pfam_index, pfam_ids):
+    """
+    Get pfam IDs not present in given index
+    :param pfam_index: pd.Index of known pfam IDs
+    :param pfam_ids: Series of pfam IDs
+    :return: numpy array of unique new pfam IDs in order of their first appearance
+    """
+    unique_ids = pd.unique(pfam_ids)
+    return unique_ids[pfam_index.get_indexer(unique_ids) == -1]
+
+
+def _add_pfam_state_counts(counts, pfam_ids, y):
+    """
+    Add number of occurences of each pfam ID in negative and positive state to a counts table
+    :param counts: DataFrame with neg and pos columns indexed by pfam_id, or None to start counting
+    :param pfam_ids: Series of pfam IDs
+    :param y: Series or array of states of each domain (0 = non-BGC, 1 = BGC)
+    :return: Updated DataFrame of counts, new pfam IDs are added to the end
+    """
+    y = np.asarray(y)
+    unique_y = set(np.unique(y))
+    if not unique_y <= {0, 1}:
+        raise AttributeError('Invalid target values, expected {0, 1} got ' + str(unique_y))
+    if counts is None:
+        counts = pd.DataFrame({'neg': [], 'pos': []}, index=pd.Index([], name='pfam_id'))
+    new_pfam_ids = _get_new_pfam_ids(counts.index, pfam_ids)
+    if len(new_pfam_ids):
+        counts = counts.reindex(counts.index.append(pd.Index(new_pfam_ids, name='pfam_id')), fill_value=0)
+    rows = counts.index.get_indexer(pfam_ids)
+    counts = counts.copy()
+    counts['neg'] += np.bincount(rows[y == 0], minlength=len(counts))
+    counts['pos'] += np.bincount(rows[y == 1], minlength=len(counts))
+    return counts
 
 
 class ProteinBorderTransformer(BaseEstimator, TransformerMixin):
@@ -214,6 +606,8 @@ class ColumnSelectTransformer(BaseEstimator, TransformerMixin):
     """
     Select given columns of input DataFrame
     """
+    rowwise = True
+
     def __init__(self, columns):
         self.columns = columns
 
@@ -3,13 +3,16 @@
 # Input/Output utilities for reading Domain CSV files
 
 import pandas as pd
+from .vocabulary import get_vocabulary
 
-def read_domains(file, max_evalue=None, min_bitscore=None):
+def read_domains(file, max_evalue=None, min_bitscore=None, vocabulary=None):
     """
     Read Domain CSV file into a Domain DataFrame
     :param file: Path to Domain CSV file
     :param max_evalue: Return only domains with e-value lower than given threshold (use None to skip)
     :param min_bitscore: Return only out domains with bitscore higher than given threshold (use None to skip)
+    :param vocabulary: Canonical PfamVocabulary (or path to vocabulary JSON file) used to add integer 'pfam_code' column (-1 for unknown Pfam IDs),
+    the checksum of the vocabulary is stored in the DataFrame attrs so that the column is used only with the same vocabulary
     :return: Domain DataFrame filtered by given evalue and bitscore
     """
     domains = pd.read_csv(file)
@@ -20,6 +23,9 @@ def read_domains(file, max_evalue=None, min_bitscore=None):
             raise AttributeError('Cannot filter on bitscore, column not present.')
         else:
             domains = domains[domains['bitscore'] > min_bitscore]
+    vocabulary = get_vocabulary(vocabulary)
+    if vocabulary is not None:
+        domains = vocabulary.encode_domains(domains)
     return domains.reset_index(drop=True)
 
 
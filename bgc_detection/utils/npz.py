@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Saving and memory-mapped loading of uncompressed NPZ files
+# Arrays are stored as uncompressed zip members, so that their data can be memory-mapped directly from the zip file
+
+import struct
+import zipfile
+import numpy as np
+from numpy.lib import format as npy_format
+
+# Size of the fixed part of a zip local file header
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def save_npz(path, arrays):
+    """
+    Save arrays to an uncompressed NPZ file
+    :param path: Output .npz file path
+    :param arrays: Dictionary of {name: array}, arrays must not contain Python objects
+    """
+    for name, array in arrays.items():
+        if np.asarray(array).dtype == object:
+            raise ValueError('Array "{}" contains Python objects, convert it to a numeric or string array first'.format(name))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_npz(path, mmap=True):
+    """
+    Load arrays of an NPZ file
+    :param path: Path to .npz file
+    :param mmap: Memory-map arrays of uncompressed members read-only instead of reading them to memory
+    :return: Dictionary of {name: array}
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                array = _map_member(f, path, info)
+                if array is not None:
+                    arrays[name] = array
+                    continue
+            with zf.open(info) as member:
+                arrays[name] = npy_format.read_array(member, allow_pickle=False)
+    return arrays
+
+
+def _map_member(f, path, info):
+    """
+    Memory-map array of an uncompressed zip member, None if it cannot be mapped (empty or scalar arrays)
+    """
+    f.seek(info.header_offset)
+    header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_length + extra_length)
+    version = npy_format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+    if dtype.hasobject or not shape or not np.prod(shape):
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Timing and memory instrumentation for model training, saved as a structured JSON log
+
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+class TimingLog(object):
+    """
+    Collect wall time of named training stages and per-epoch throughput statistics
+    """
+    def __init__(self, **info):
+        """
+        :param info: Additional values to store in the log (e.g. model type and label)
+        """
+        self.info = info
+        self.sections = {}
+        self.epochs = []
+
+    @contextmanager
+    def section(self, name):
+        """
+        Measure wall time of a block of code, time of repeated sections with the same name is summed up.
+        :param name: Name of the section
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.sections[name] = self.sections.get(name, 0) + time.time() - start
+
+    def add_epoch(self, **values):
+        """
+        Add statistics of a single training epoch, peak RSS is added automatically
+        :param values: Epoch statistics
+        """
+        values['peak_rss_mb'] = get_peak_rss_mb()
+        self.epochs.append(values)
+
+    def to_dict(self):
+        return {
+            'info': self.info,
+            'sections': self.sections,
+            'epochs': self.epochs,
+            'peak_rss_mb': get_peak_rss_mb()
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return self
+
+
+def get_peak_rss_mb():
+    """
+    Get peak resident set size of the current process
+    :return: Peak RSS in megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def get_timing_log_path(model_path):
+    """
+    Get path of the JSON timing log stored next to given model file
+    :param model_path: Path to model pickle file
+    :return: Path to JSON timing log
+    """
+    return os.path.splitext(model_path)[0] + '.timing.json'
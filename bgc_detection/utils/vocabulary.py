@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# Canonical Pfam vocabulary shared by the feature transformers, HMM models and similarity tools
+# Each Pfam ID is represented by an integer code - its position in the vocabulary, unknown Pfam IDs get code -1
+# Run as a script to build a versioned vocabulary JSON file from Domain CSV files and/or pfam2vec files
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+VOCABULARY_FORMAT_VERSION = 1
+
+# Domain DataFrame attribute (DataFrame.attrs) with checksum of the vocabulary used to encode the pfam_code column
+VOCABULARY_ATTR = 'pfam_vocabulary'
+
+_loaded_vocabularies = {}
+
+
+class PfamVocabulary(object):
+    """
+    Versioned list of unique Pfam IDs, Pfam IDs are encoded as their position in the list.
+    """
+    def __init__(self, pfam_ids, version=None):
+        """
+        :param pfam_ids: List of unique Pfam IDs
+        :param version: Vocabulary version (e.g. Pfam database release)
+        """
+        self.pfam_ids = np.asarray(pfam_ids, dtype=object)
+        self.version = version
+        self.index = pd.Index(self.pfam_ids)
+        if not self.index.is_unique:
+            raise ValueError('Vocabulary Pfam IDs have to be unique')
+
+    def __len__(self):
+        return len(self.pfam_ids)
+
+    @property
+    def checksum(self):
+        """
+        MD5 checksum of the Pfam IDs, used to check that two vocabularies encode Pfam IDs the same way
+        """
+        if getattr(self, '_checksum', None) is None:
+            self._checksum = hashlib.md5(' '.join(self.pfam_ids).encode('utf-8')).hexdigest()
+        return self._checksum
+
+    def encode(self, pfam_ids):
+        """
+        Get integer codes of given Pfam IDs
+        :param pfam_ids: List or Series of Pfam IDs
+        :return: numpy int32 array of codes, -1 for Pfam IDs not present in the vocabulary
+        """
+        return self.index.get_indexer(pfam_ids).astype(np.int32)
+
+    def decode(self, codes):
+        """
+        Get Pfam IDs of given integer codes
+        :param codes: Array of codes
+        :return: numpy array of Pfam IDs, None for code -1
+        """
+        codes = np.asarray(codes)
+        return np.where(codes >= 0, self.pfam_ids[codes], None)
+
+    def encode_domains(self, domains):
+        """
+        Add integer pfam_code column to a Domain DataFrame, marked with the checksum of this vocabulary
+        :param domains: Domain DataFrame with a pfam_id column
+        :return: Domain DataFrame with pfam_code column
+        """
+        domains = domains.assign(pfam_code=self.encode(domains['pfam_id']))
+        domains.attrs[VOCABULARY_ATTR] = self.checksum
+        return domains
+
+    def has_codes(self, X):
+        """
+        Check that a Domain DataFrame has a pfam_code column encoded using this vocabulary (see encode_domains)
+        """
+        return 'pfam_code' in X.columns and X.attrs.get(VOCABULARY_ATTR) == self.checksum
+
+    def get_codes(self, X):
+        """
+        Get integer codes of a Domain DataFrame, uses the pfam_code column if it was encoded using this vocabulary
+        :param X: Domain DataFrame read using this vocabulary or with a pfam_id column
+        :return: numpy int32 array of codes, -1 for Pfam IDs not present in the vocabulary
+        """
+        if self.has_codes(X):
+            return X['pfam_code'].values
+        return self.encode(X['pfam_id'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'format_version': VOCABULARY_FORMAT_VERSION,
+                'version': self.version,
+                'checksum': self.checksum,
+                'pfam_ids': list(self.pfam_ids)
+            }, f)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('format_version') != VOCABULARY_FORMAT_VERSION:
+            raise ValueError('Unsupported vocabulary format version {} in {}'.format(data.get('format_version'), path))
+        vocabulary = PfamVocabulary(data['pfam_ids'], version=data.get('version'))
+        if vocabulary.checksum != data.get('checksum'):
+            raise ValueError('Vocabulary checksum does not match in {}'.format(path))
+        return vocabulary
+
+    @classmethod
+    def from_pfam_ids(cls, pfam_ids, version=None):
+        """
+        Create vocabulary of sorted unique Pfam IDs from given list of Pfam IDs
+        """
+        return PfamVocabulary(np.unique(np.asarray(pfam_ids, dtype=object)), version=version)
+
+
+def get_vocabulary(vocabulary):
+    """
+    Get PfamVocabulary object from given path, loaded vocabularies are cached so that they can be shared.
+    :param vocabulary: Path to vocabulary JSON file, PfamVocabulary object or None
+    :return: PfamVocabulary object or None
+    """
+    if vocabulary is None or isinstance(vocabulary, PfamVocabulary):
+        return vocabulary
+    path = os.path.abspath(vocabulary)
+    if path not in _loaded_vocabularies:
+        _loaded_vocabularies[path] = PfamVocabulary.load(path)
+    return _loaded_vocabularies[path]
+
+
+class PfamLookup(object):
+    """
+    Map Pfam IDs of Domain DataFrames to row numbers of a table indexed by Pfam IDs.
+    When a canonical vocabulary is provided and the DataFrame has a pfam_code column encoded using the same vocabulary
+    (see io.read_domains), rows are looked up by the integer codes instead of the Pfam ID strings.
+    """
+    def __init__(self, pfam_ids, vocabulary=None):
+        """
+        :param pfam_ids: Pfam IDs of the table rows
+        :param vocabulary: Canonical PfamVocabulary used to encode the pfam_code column
+        """
+        self.index = pd.Index(pfam_ids)
+        self.vocabulary = vocabulary
+        self.code_rows = None
+        if vocabulary is not None:
+            # Row of each vocabulary code, code -1 (last element) is mapped to row -1
+            self.code_rows = np.append(self.index.get_indexer(vocabulary.pfam_ids), -1)
+
+    def get_rows(self, X):
+        """
+        Get table row numbers for each domain in a Domain DataFrame
+        :param X: Domain DataFrame
+        :return: numpy array of row numbers, -1 for Pfam IDs not present in the table
+        """
+        if self.code_rows is not None and self.vocabulary.has_codes(X):
+            return self.code_rows[X['pfam_code'].values]
+        return self.index.get_indexer(X['pfam_id'])
+
+
+def take_rows(table, rows):
+    """
+    Select rows of a table, rows with index -1 are filled with zeros
+    :param table: numpy matrix
+    :param rows: Array of row numbers
+    :return: numpy matrix with selected rows
+    """
+    rows = np.asarray(rows)
+    if not len(table):
+        return np.zeros((len(rows),) + table.shape[1:], dtype=table.dtype)
+    selected = table[rows]
+    selected[rows < 0] = 0
+    return selected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", dest="input", required=False, action='append', default=[],
+                        help="Domain CSV file or folder with Domain CSV files (repeat for multiple paths).", metavar="FILE")
+    parser.add_argument("-p", "--pfam2vec", dest="pfam2vec", required=False, action='append', default=[],
+                        help="Pfam2vec CSV file with pfam_id column (repeat for multiple files).", metavar="FILE")
+    parser.add_argument("-v", "--version", dest="version", required=True,
+                        help="Vocabulary version (e.g. Pfam release).", metavar="STRING")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        help="Output vocabulary JSON file path.", metavar="FILE")
+    options = parser.parse_args()
+
+    pfam_ids = set()
+    paths = []
+    for path in options.input:
+        paths += sorted(glob.glob(os.path.join(path, '*.csv'))) if os.path.isdir(path) else [path]
+    for path in paths:
+        pfam_ids.update(pd.read_csv(path, usecols=['pfam_id'])['pfam_id'].unique())
+    for path in options.pfam2vec:
+        pfam_ids.update(pd.read_csv(path, usecols=['pfam_id'])['pfam_id'])
+
+    vocabulary = PfamVocabulary.from_pfam_ids(list(pfam_ids), version=options.version)
+    vocabulary.save(options.output)
+    print('Saved vocabulary {} of {} Pfam IDs from {} files to {}'.format(
+        vocabulary.version, len(vocabulary), len(paths) + len(options.pfam2vec), options.output))